@@ -0,0 +1,179 @@
+'''
+Batch evaluation with NumPy, for looking back over finished games
+without walking a Board for every position.
+
+Positions are encoded as arrays (see encode()), and evaluate()
+scores a whole batch with array operations: material and
+piece-square scores, which add up to Board.evaluate(), and
+mobility, the number of squares white's pieces can move to less
+black's.
+
+    positions = game_positions(['e2e4', 'e7e5', 'g1f3'])
+    scores = evaluate(positions)
+    scores['total']    # one score per position, + for white
+'''
+import numpy as np
+
+from chess import (BISHOP_DIRECTIONS, KING_ATTACKS, KNIGHT_ATTACKS,
+                   PIECE_SCORES, PIECE_VALUES, ROOK_DIRECTIONS, Bishop,
+                   Board, King, Knight, MoveError, Queen, Rook, uci)
+
+
+# Centipawns per square of mobility in the total score
+MOBILITY_WEIGHT = 4
+
+# PIECE_SCORES by (bitboard index, square), and the material part
+SCORES = np.array(PIECE_SCORES, dtype=np.int32).reshape(12, 64)
+MATERIAL = np.array(PIECE_VALUES + tuple(-v for v in PIECE_VALUES),
+                    dtype=np.int32)
+
+# Whether a knight or king on the first square attacks the second;
+# float so that products go through BLAS
+KNIGHT_MATRIX = np.array([[table >> target & 1 for target in range(64)]
+                          for table in KNIGHT_ATTACKS], dtype=np.float32)
+KING_MATRIX = np.array([[table >> target & 1 for target in range(64)]
+                        for table in KING_ATTACKS], dtype=np.float32)
+
+
+def _ray_squares():
+    '''
+    The squares along each ray from each square, nearest first, as
+    a (64, 8, 8) array; rook directions come first. Past the edge of
+    the board rays are padded with 64, an extra square that blocks
+    every ray (a ray is at most 7 squares, so each ends in one).
+    '''
+    rays = np.full((64, 8, 8), 64, dtype=np.intp)
+    for sq in range(64):
+        for d, (dcol, drow) in enumerate(ROOK_DIRECTIONS
+                                         + BISHOP_DIRECTIONS):
+            c, r = (sq & 7) + dcol, (sq >> 3) + drow
+            step = 0
+            while 0 <= c < 8 and 0 <= r < 8:
+                rays[sq, d, step] = r * 8 + c
+                c, r, step = c + dcol, r + drow, step + 1
+    return rays
+
+
+RAY_SQUARES = _ray_squares()
+_SQUARE_INDEX = np.arange(64)[:, None]
+_RAY_INDEX = np.arange(8)[None, :]
+
+
+def unpack(bitboards, planes=True):
+    '''
+    Turn an (N, 12) uint64 array of Board bitboards into positions.
+
+    Returns:
+    (N, 12, 64) uint8 array, 1 where bitboard index p has a piece
+    on square s; or, if not `planes`, an (N, 64) int8 array holding
+    the bitboard index + 1 of the piece on each square, 0 if empty
+    '''
+    shifts = np.arange(64, dtype=np.uint64)
+    bits = (bitboards[:, :, None] >> shifts & np.uint64(1)).astype(np.uint8)
+    if planes:
+        return bits
+    return (bits * np.arange(1, 13, dtype=np.uint8)[:, None]) \
+        .sum(axis=1, dtype=np.int8)
+
+
+def encode(boards, planes=True):
+    '''Encode Boards as positions, as described in unpack().'''
+    return unpack(np.array([board._bitboards for board in boards],
+                           dtype=np.uint64).reshape(-1, 12), planes)
+
+
+def game_positions(moves, fen=None, planes=True):
+    '''
+    Play `moves`, in long algebraic notation as uci() names them
+    (e.g. 'e2e4', 'e7e8q'), from the usual starting position or
+    from `fen`.
+
+    Returns:
+    the position before the first move and after each move, as
+    described in unpack()
+
+    Raises:
+    MoveError if a move is not legal
+    ValueError if `fen` is not a valid position
+    '''
+    if fen is None:
+        board = Board()
+        board.start()
+    else:
+        board = Board.from_fen(fen)
+    bitboards = [list(board._bitboards)]
+    for ply, name in enumerate(moves, 1):
+        legal = {uci(move): move for move in board._legal_moves()}
+        move = legal.get(name)
+        if move is None:
+            raise MoveError(f'Illegal move {name!r} at ply {ply}')
+        board._play(move)
+        board._switch_turn()
+        bitboards.append(list(board._bitboards))
+    return unpack(np.array(bitboards, dtype=np.uint64), planes)
+
+
+def mobility(planes):
+    '''
+    Squares each side's knights, bishops, rooks, queens and king
+    can move to (ignoring checks and castling), for (N, 12, 64)
+    positions.
+
+    Returns:
+    (N, 2) int array of white's and black's counts
+    '''
+    n = len(planes)
+    colours = planes.reshape(n, 2, 6, 64).any(axis=2)
+    edge = np.ones((n, 1), bool)
+    occupied = np.concatenate([colours.any(axis=1), edge], axis=1)
+    # Empty squares before the first piece (or the edge) on each
+    # ray, and that piece's square: (N, 64, 8)
+    steps = occupied[:, RAY_SQUARES].argmax(axis=-1)
+    blockers = RAY_SQUARES[_SQUARE_INDEX, _RAY_INDEX, steps].reshape(n, -1)
+    counts = np.zeros((n, 2), dtype=np.int64)
+    for colour in range(2):
+        pieces = planes[:, colour * 6:colour * 6 + 6]
+        free = ~colours[:, colour]
+        # Capturing the blocker is a move too
+        theirs = np.concatenate([colours[:, 1 - colour], ~edge], axis=1)
+        rays = steps + np.take_along_axis(theirs, blockers, axis=1) \
+            .reshape(n, 64, 8)
+        queens = pieces[:, Queen.kind]
+        sliders = (rays[:, :, :4].sum(axis=-1)
+                   * (pieces[:, Rook.kind] | queens)
+                   + rays[:, :, 4:].sum(axis=-1)
+                   * (pieces[:, Bishop.kind] | queens))
+        steppers = pieces[:, Knight.kind] @ KNIGHT_MATRIX \
+            + pieces[:, King.kind] @ KING_MATRIX
+        counts[:, colour] = sliders.sum(axis=1) \
+            + (steppers * free).sum(axis=1).astype(np.int64)
+    return counts
+
+
+def evaluate(positions):
+    '''
+    Score a batch of positions, (N, 12, 64) or (N, 64) as made by
+    unpack(). All scores are in centipawns, positive for white.
+
+    Returns:
+    {'material': ..., 'piece_square': ..., 'mobility': ...,
+     'total': ...}, each an (N,) int array; mobility is white's
+    count of moves less black's, and total adds it, times
+    MOBILITY_WEIGHT, to the other two
+    '''
+    positions = np.asarray(positions)
+    if positions.ndim == 2:
+        positions = positions[:, None, :] \
+            == np.arange(1, 13, dtype=positions.dtype)[None, :, None]
+    planes = positions.astype(bool)
+    counts = planes.sum(axis=2, dtype=np.int32)
+    material = counts @ MATERIAL
+    piece_square = np.einsum('nps,ps->n', planes.astype(np.int32),
+                             SCORES) - material
+    moves = mobility(planes)
+    difference = moves[:, 0] - moves[:, 1]
+    return {'material': material,
+            'piece_square': piece_square,
+            'mobility': difference,
+            'total': material + piece_square
+            + MOBILITY_WEIGHT * difference}
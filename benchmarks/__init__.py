@@ -0,0 +1,57 @@
+'''
+Benchmarks, run from the repository root:
+    python -m benchmarks.perft    move generation speed
+    python -m benchmarks.micro    Board and MoveHistory operations
+    python -m benchmarks.macro    scripted games through the web app
+
+micro and macro write their results as JSON (see report()), so
+runs on different commits can be compared.
+'''
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+
+def commit():
+    '''The checked out git commit, or None outside a git checkout.'''
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'],
+                              capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def summary(times):
+    '''Statistics in microseconds for a list of timings in seconds.'''
+    times = sorted(times)
+    return {
+        'count': len(times),
+        'mean_us': statistics.fmean(times) * 1e6,
+        'min_us': times[0] * 1e6,
+        'p50_us': times[len(times) // 2] * 1e6,
+        'p99_us': times[min(len(times) - 1, len(times) * 99 // 100)] * 1e6,
+    }
+
+
+def report(suite, results, output=None):
+    '''
+    Write `results` as JSON to `output` (a path) or stdout, along
+    with the commit and Python version they were measured on.
+    '''
+    document = {
+        'suite': suite,
+        'commit': commit(),
+        'python': platform.python_version(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'results': results,
+    }
+    text = json.dumps(document, indent=2) + '\n'
+    if output is None:
+        sys.stdout.write(text)
+    else:
+        with open(output, 'w') as f:
+            f.write(text)
@@ -0,0 +1,113 @@
+'''
+Macro benchmark: plays scripted games through the web app with
+Flask's test client (/newgame, then /play, /promote and /undo
+requests) and writes requests/sec and latency per route as JSON.
+
+The games are random but seeded, so every run sends the same
+requests.
+
+Run from the repository root:
+    python -m benchmarks.macro
+    python -m benchmarks.macro --games 50 --output macro.json
+'''
+import argparse
+import random
+import sys
+import tempfile
+import time
+
+from benchmarks import report, summary
+from chess import Board, PROMOTIONS, Queen, to_coord
+
+
+def script(seed, plies=200, undo_every=15):
+    '''
+    The requests for one game, as (route, data) pairs. Pawns
+    promote to queens, and every `undo_every` plies a move is
+    taken back.
+    '''
+    rng = random.Random(seed)
+    board = Board()
+    board.start()
+    requests = [('/newgame', None)]
+    for ply in range(1, plies + 1):
+        moves = [move for move in board._legal_moves()
+                 if PROMOTIONS.get(move >> 12, Queen) is Queen]
+        if not moves:
+            break
+        move = rng.choice(moves)
+        start, end = to_coord(move & 63), to_coord(move >> 6 & 63)
+        requests.append(('/play', {'move': '%d%d %d%d' % (start + end)}))
+        if move >> 12 in PROMOTIONS:
+            requests.append(('/promote', {'promote': 'Queen'}))
+        board._play(move)
+        board.next_turn()
+        if board.winner is not None:
+            break
+        if ply % undo_every == 0:
+            requests.append(('/undo', None))
+            board.undo(board.movehistory.pop())
+            board._switch_turn()
+    return requests
+
+
+def run(scripts):
+    '''
+    Send every script's requests through a test client.
+
+    Returns:
+    (seconds per request by route, total seconds)
+    '''
+    import main
+    app = main.create_app(
+        JOURNAL_DIR=tempfile.mkdtemp(prefix='chess-journal-'))
+    invalid = main.INVALID_MOVES.value
+    times = {}
+    began = time.perf_counter()
+    for requests in scripts:
+        client = app.test_client()
+        for route, data in requests:
+            started = time.perf_counter()
+            if route == '/play':
+                response = client.post(route, data=data)
+            else:
+                response = client.get(route, query_string=data)
+            times.setdefault(route, []).append(time.perf_counter() - started)
+            if response.status_code >= 400:
+                raise RuntimeError(f'{route} {data}: {response.status}')
+    elapsed = time.perf_counter() - began
+    if main.INVALID_MOVES.value != invalid:
+        raise RuntimeError('The app rejected moves from the script')
+    return times, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--games', type=int, default=20,
+                        help='games to play')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='seed of the first game')
+    parser.add_argument('--output', help='JSON file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    scripts = [script(seed)
+               for seed in range(args.seed, args.seed + args.games)]
+    times, elapsed = run(scripts)
+    requests = sum(map(len, times.values()))
+    results = {'requests': requests,
+               'seconds': elapsed,
+               'requests_per_second': requests / elapsed,
+               'routes': {route: summary(route_times)
+                          for route, route_times in sorted(times.items())}}
+    for route, stats in results['routes'].items():
+        print(f'{route:<10} {stats["count"]:>7} requests '
+              f'{stats["p50_us"] / 1000:8.2f} ms p50 '
+              f'{stats["p99_us"] / 1000:8.2f} ms p99', file=sys.stderr)
+    print(f'{requests} requests in {elapsed:.2f}s '
+          f'({requests / elapsed:.0f} requests/s)', file=sys.stderr)
+    report('macro', results, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
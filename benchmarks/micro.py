@@ -0,0 +1,152 @@
+'''
+Micro benchmarks: times single Board and MoveHistory operations
+on fixed positions and writes the results as JSON.
+
+Run from the repository root:
+    python -m benchmarks.micro
+    python -m benchmarks.micro --repeat 5000 --output micro.json
+'''
+import argparse
+import sys
+import time
+
+from benchmarks import report, summary
+from benchmarks.perft import POSITIONS
+from chess import Board, MoveHistory, to_coord
+
+
+def boards():
+    '''The positions every benchmark is run on, by name.'''
+    start = Board()
+    start.start()
+    return {'startpos': start,
+            'kiwipete': Board.from_fen(POSITIONS['kiwipete'][0])}
+
+
+def coords(move):
+    return to_coord(move & 63), to_coord(move >> 6 & 63)
+
+
+def bench_movetype(board, repeat):
+    moves = [coords(move) for move in board._legal_moves()]
+    times = []
+    for i in range(repeat):
+        start, end = moves[i % len(moves)]
+        began = time.perf_counter()
+        board.movetype(start, end)
+        times.append(time.perf_counter() - began)
+    return times
+
+
+def bench_prompt(board, repeat):
+    moves = ['%d%d %d%d' % (coords(move)[0] + coords(move)[1])
+             for move in board._legal_moves()]
+    times = []
+    for i in range(repeat):
+        move = moves[i % len(moves)]
+        began = time.perf_counter()
+        board.prompt(move)
+        times.append(time.perf_counter() - began)
+    return times
+
+
+def bench_update(board, repeat):
+    '''Board.update(), with an untimed undo after each move.'''
+    moves = [move for _, move in zip(range(repeat), board.legal_moves())]
+    times = []
+    for i in range(repeat):
+        move = moves[i % len(moves)]
+        began = time.perf_counter()
+        board.update(move)
+        times.append(time.perf_counter() - began)
+        board.undo(board.movehistory.pop())
+    return times
+
+
+def bench_undo(board, repeat):
+    '''Board.undo(), with an untimed update before each undo.'''
+    moves = [move for _, move in zip(range(repeat), board.legal_moves())]
+    times = []
+    for i in range(repeat):
+        board.update(moves[i % len(moves)])
+        move = board.movehistory.pop()
+        began = time.perf_counter()
+        board.undo(move)
+        times.append(time.perf_counter() - began)
+    return times
+
+
+def bench_legal_moves(board, repeat):
+    '''Board._legal_moves() without its cached list.'''
+    times = []
+    for _ in range(repeat):
+        board._legal = (None, None)
+        began = time.perf_counter()
+        board._legal_moves()
+        times.append(time.perf_counter() - began)
+    return times
+
+
+def bench_display(board, repeat):
+    times = []
+    for _ in range(repeat):
+        began = time.perf_counter()
+        board.display()
+        times.append(time.perf_counter() - began)
+    return times
+
+
+def bench_movehistory(board, repeat):
+    '''
+    One push() and one pop() on a history of 200 moves. The
+    board is not used.
+    '''
+    history = MoveHistory()
+    for move in range(200):
+        history.push(move)
+    times = []
+    for move in range(repeat):
+        began = time.perf_counter()
+        history.push(move)
+        history.pop()
+        times.append(time.perf_counter() - began)
+    return times
+
+
+BENCHMARKS = {
+    'movetype': bench_movetype,
+    'prompt': bench_prompt,
+    'update': bench_update,
+    'undo': bench_undo,
+    'legal_moves': bench_legal_moves,
+    'display': bench_display,
+    'movehistory': bench_movehistory,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--benchmark', choices=sorted(BENCHMARKS),
+                        action='append',
+                        help='benchmark to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=2000,
+                        help='timed calls per benchmark and position')
+    parser.add_argument('--output', help='JSON file (default: stdout)')
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name in args.benchmark or BENCHMARKS:
+        positions = boards()
+        if name == 'movehistory':
+            positions = {'none': None}
+        for position, board in positions.items():
+            stats = summary(BENCHMARKS[name](board, args.repeat))
+            results[f'{name}/{position}'] = stats
+            print(f'{name + "/" + position:<24} {stats["p50_us"]:9.2f} us p50 '
+                  f'{stats["p99_us"]:9.2f} us p99', file=sys.stderr)
+    report('micro', results, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,87 @@
+'''
+Perft benchmark: counts legal move paths on standard test
+positions, checks them against the published node counts and
+reports nodes per second.
+
+Run from the repository root:
+    python -m benchmarks.perft
+    python -m benchmarks.perft --depth 5 --position startpos
+    python -m benchmarks.perft --divide 3 --position kiwipete
+'''
+import argparse
+import sys
+import time
+
+from chess import Board
+
+
+# name: (FEN, default depth, node counts by depth starting at 1)
+POSITIONS = {
+    'startpos': (
+        'rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+        4, [20, 400, 8902, 197281, 4865609]),
+    'kiwipete': (
+        'r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1',
+        3, [48, 2039, 97862, 4085603]),
+    'position3': (
+        '8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1',
+        4, [14, 191, 2812, 43238, 674624]),
+    'position4': (
+        'r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1',
+        3, [6, 264, 9467, 422333]),
+    'position5': (
+        'rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8',
+        3, [44, 1486, 62379, 2103487]),
+    'position6': (
+        'r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10',
+        3, [46, 2079, 89890, 3894594]),
+}
+
+
+def run(name, depth):
+    fen, _, expected = POSITIONS[name]
+    board = Board.from_fen(fen)
+    start = time.perf_counter()
+    nodes = board.perft(depth)
+    elapsed = time.perf_counter() - start
+    ok = depth > len(expected) or nodes == expected[depth - 1]
+    print(f'{name:<10} depth {depth}  {nodes:>10} nodes  '
+          f'{elapsed:8.2f}s  {nodes / elapsed:>10.0f} nodes/s  '
+          f'{"ok" if ok else "MISMATCH"}')
+    return ok, nodes, elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--position', choices=sorted(POSITIONS),
+                        action='append',
+                        help='position to run (default: all)')
+    parser.add_argument('--depth', type=int,
+                        help='search depth (default: per position)')
+    parser.add_argument('--divide', type=int, metavar='DEPTH',
+                        help='print the node count for each first move')
+    args = parser.parse_args(argv)
+    names = args.position or list(POSITIONS)
+
+    if args.divide is not None:
+        for name in names:
+            counts = Board.from_fen(POSITIONS[name][0]).divide(args.divide)
+            for move, count in sorted(counts.items()):
+                print(f'{move}: {count}')
+            print(f'\n{len(counts)} moves, {sum(counts.values())} nodes')
+        return 0
+
+    total_nodes = total_time = 0
+    failed = False
+    for name in names:
+        ok, nodes, elapsed = run(name, args.depth or POSITIONS[name][1])
+        failed = failed or not ok
+        total_nodes += nodes
+        total_time += elapsed
+    print(f'{"total":<10}          {total_nodes:>10} nodes  '
+          f'{total_time:8.2f}s  {total_nodes / total_time:>10.0f} nodes/s')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,81 @@
+'''
+Builds an opening book (see chess.OpeningBook) from PGN files:
+every move played in the first plies of the games is counted,
+and the counts become the weights the engine picks moves by.
+
+Run from the repository root:
+    python book.py games.pgn -o instance/book.bin
+    python book.py --plies 16 --min-count 3 archive.pgn
+'''
+import argparse
+import os
+import sys
+from collections import Counter
+
+from chess import Board, BOOK_ENTRY, MoveError
+from pgn import find_move, read_games
+
+
+def count_moves(paths, plies):
+    '''
+    Count the (Board.hash, packed move) pairs in the first
+    `plies` plies of every game in `paths`.
+    '''
+    counts = Counter()
+    for path in paths:
+        for game in read_games(path):
+            if 'FEN' in game.headers:
+                continue
+            board = Board()
+            board.start()
+            for san in game.moves[:plies]:
+                try:
+                    move = find_move(board, san, board._legal_moves())
+                except MoveError:
+                    break
+                counts[board.hash, move] += 1
+                board._play(move)
+                board._switch_turn()
+    return counts
+
+
+def write_book(path, counts, min_count=1):
+    '''
+    Write `counts` as a book file, leaving out moves played
+    fewer than `min_count` times.
+
+    Returns:
+    number of entries written
+    '''
+    entries = sorted((key, move, min(count, 0xFFFF))
+                     for (key, move), count in counts.items()
+                     if count >= min_count)
+    with open(path, 'wb') as f:
+        for key, move, weight in entries:
+            f.write(BOOK_ENTRY.pack(key, move, weight, 0))
+    return len(entries)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('paths', nargs='+', metavar='FILE',
+                        help='PGN file to read')
+    parser.add_argument('-o', '--output', default=os.path.join(
+        'instance', 'book.bin'), help='book file to write')
+    parser.add_argument('--plies', type=int, default=20,
+                        help='plies of each game to use')
+    parser.add_argument('--min-count', type=int, default=1,
+                        help='leave out moves played fewer times')
+    args = parser.parse_args(argv)
+
+    counts = count_moves(args.paths, args.plies)
+    directory = os.path.dirname(args.output)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    entries = write_book(args.output, counts, args.min_count)
+    print(f'Wrote {entries} entries to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
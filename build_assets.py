@@ -0,0 +1,152 @@
+'''
+Packs the piece images in static/chesspieces/ into one sprite
+sheet, static/chesspieces/sprite.png, and writes static/pieces.css
+with a class per piece (piece-WKing, piece-BP, ...) that shows
+its part of the sheet. The board then needs a single image
+request instead of one per piece type.
+
+Run it again whenever the piece images change:
+    python build_assets.py
+'''
+import glob
+import hashlib
+import os
+import struct
+import zlib
+
+
+STATIC = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+PIECES = os.path.join(STATIC, 'chesspieces')
+SPRITE = os.path.join(PIECES, 'sprite.png')
+STYLESHEET = os.path.join(STATIC, 'pieces.css')
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+BYTES_PER_PIXEL = 4  # 8-bit RGBA
+
+
+def paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = abs(p - a), abs(p - b), abs(p - c)
+    if pa <= pb and pa <= pc:
+        return a
+    elif pb <= pc:
+        return b
+    return c
+
+
+def read_png(path):
+    '''
+    Decode an 8-bit RGBA, non-interlaced PNG.
+
+    Returns:
+    (width, height, list of rows of RGBA bytes)
+    '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError(f'{path} is not a PNG file')
+    pos = len(PNG_SIGNATURE)
+    compressed = b''
+    while pos < len(data):
+        length, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + length]
+        if kind == b'IHDR':
+            width, height, depth, colour, _, _, interlace = \
+                struct.unpack('>IIBBBBB', body)
+            if (depth, colour, interlace) != (8, 6, 0):
+                raise ValueError(f'{path} is not 8-bit RGBA '
+                                 'without interlacing')
+        elif kind == b'IDAT':
+            compressed += body
+        pos += 12 + length
+    raw = zlib.decompress(compressed)
+    stride = width * BYTES_PER_PIXEL
+    rows = []
+    previous = bytearray(stride)
+    for y in range(height):
+        start = y * (stride + 1)
+        filter_type = raw[start]
+        row = bytearray(raw[start + 1:start + 1 + stride])
+        for x in range(stride):
+            a = row[x - BYTES_PER_PIXEL] if x >= BYTES_PER_PIXEL else 0
+            b = previous[x]
+            c = previous[x - BYTES_PER_PIXEL] if x >= BYTES_PER_PIXEL else 0
+            if filter_type == 1:
+                row[x] = (row[x] + a) & 0xFF
+            elif filter_type == 2:
+                row[x] = (row[x] + b) & 0xFF
+            elif filter_type == 3:
+                row[x] = (row[x] + (a + b) // 2) & 0xFF
+            elif filter_type == 4:
+                row[x] = (row[x] + paeth(a, b, c)) & 0xFF
+        rows.append(bytes(row))
+        previous = row
+    return width, height, rows
+
+
+def png_chunk(kind, body):
+    return struct.pack('>I', len(body)) + kind + body \
+        + struct.pack('>I', zlib.crc32(kind + body))
+
+
+def write_png(path, width, height, rows):
+    '''Encode RGBA rows as a PNG, using the Sub filter per row.'''
+    raw = bytearray()
+    for row in rows:
+        raw.append(1)
+        raw.extend(row[:BYTES_PER_PIXEL])
+        for x in range(BYTES_PER_PIXEL, len(row)):
+            raw.append((row[x] - row[x - BYTES_PER_PIXEL]) & 0xFF)
+    header = struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)
+    with open(path, 'wb') as f:
+        f.write(PNG_SIGNATURE)
+        f.write(png_chunk(b'IHDR', header))
+        f.write(png_chunk(b'IDAT', zlib.compress(bytes(raw), 9)))
+        f.write(png_chunk(b'IEND', b''))
+
+
+def build():
+    '''Write the sprite sheet and its stylesheet.'''
+    names = sorted(os.path.splitext(os.path.basename(path))[0]
+                   for path in glob.glob(os.path.join(PIECES, '*.png')))
+    # Empty squares need no image, and the sheet is not an input
+    names = [name for name in names if name not in ('None', 'sprite')]
+    images = [read_png(os.path.join(PIECES, f'{name}.png'))
+              for name in names]
+    width, height = images[0][0], images[0][1]
+    for name, image in zip(names, images):
+        if image[:2] != (width, height):
+            raise ValueError(f'{name}.png is not {width}x{height}')
+
+    rows = [b''.join(image[2][y] for image in images)
+            for y in range(height)]
+    write_png(SPRITE, width * len(images), height, rows)
+    with open(SPRITE, 'rb') as f:
+        version = hashlib.sha1(f.read()).hexdigest()[:12]
+
+    lines = [
+        '/* Generated by build_assets.py - do not edit. */',
+        '.piece {',
+        '    display: inline-block;',
+        f'    width: {width}px;',
+        f'    height: {height}px;',
+        '    vertical-align: middle;',
+        '    background-repeat: no-repeat;',
+        f'    background-image: url("chesspieces/sprite.png?v={version}");',
+        '}',
+        '.piece-None {',
+        '    background-image: none;',
+        '}',
+    ]
+    for i, name in enumerate(names):
+        lines.append(f'.piece-{name} {{ background-position: '
+                     f'{-i * width}px 0; }}')
+    with open(STYLESHEET, 'w') as f:
+        f.write('\n'.join(lines) + '\n')
+    return names
+
+
+if __name__ == '__main__':
+    names = build()
+    print(f'Packed {len(names)} pieces into {SPRITE}')
+    print(f'Wrote {STYLESHEET}')
@@ -1,4 +1,13 @@
 # from main import promote
+import logging
+import mmap
+import os
+import random
+import struct
+from array import array
+
+
+logger = logging.getLogger(__name__)
 
 
 class WebInterface:
@@ -9,54 +18,72 @@ class WebInterface:
         self.board = None
         self.info = None
         self.empty = True
+        self.game_id = None
+        self.watch_id = None   # public id for spectators
+        self.score = 0         # evaluation in centipawns, + for white
+        self.eval_bar = 50     # percent of the eval bar shown as white
+        self.engine = None     # colour played by the engine, if any
+        self.engine_ms = None  # engine thinking time per move
 
 class MoveHistory:
-    '''MoveHistory works like a CircularStack'''
-    def __init__(self, size):
-        # Remember to validate input
-        self.size = size
-        self.__data = [None] * size
-        self.head = None
-    
+    '''
+    Stack of the moves played, stored as packed ints in an array
+    (see Board._pack() for the layout), plus a stack of undone
+    moves that can be redone. There is no length limit.
+    '''
+    def __init__(self):
+        self._moves = array('Q')
+        self._undone = array('Q')
+
+    def __len__(self):
+        return len(self._moves)
+
+    def __getitem__(self, ply):
+        return self._moves[ply]
+
     def push(self, move):
-        if self.head is None:
-            self.head = 0
-        else:
-            self.head = (self.head + 1) % self.size
-        self.__data[self.head] = move
-            
+        '''Record a new move; this forgets any undone moves.'''
+        self._moves.append(move)
+        if self._undone:
+            del self._undone[:]
+
     def pop(self):
-        # Remember to check if MoveHistory is empty
-        move = self.__data[self.head]
-        self.__data[self.head] = None
-        if self.head is None:
+        '''Remove the last move and keep it for redo().'''
+        if not self._moves:
             raise IndexError("No move history.")
+        move = self._moves.pop()
+        self._undone.append(move)
+        return move
 
-        elif self.head == 0:
-            self.head = self.size - 1
-        else:
-            self.head -= 1
+    def redo(self):
+        '''Put the last popped move back and return it.'''
+        if not self._undone:
+            raise IndexError("No move to redo.")
+        move = self._undone.pop()
+        self._moves.append(move)
         return move
 
+    def amend(self, move):
+        '''Replace the last move.'''
+        self._moves[-1] = move
+
     def empty(self):
-        empty = True
-        for data in self.__data:
-            if data is not None:
-                empty = False
-        return empty
+        return not self._moves
+
+    def undone(self):
+        '''Number of moves that can be redone.'''
+        return len(self._undone)
 
 
 class Move:
-    def __init__(self, start, end, Board):
+    def __init__(self, start, end, Board, promotion=None):
         self.start = start
         self.end = end
+        self.promotion = promotion
         self.player = Board.turn
-        self.addedpiece = Board.get_piece(start)
-        self.removedpiece = Board.get_piece(end)
         self.x, self.y, self.dist = self.vector(self.start,self.end)
         self.step = self.dist
-        self.added = [{self.end: self.addedpiece}]
-        self.removed = [{self.start: self.removedpiece},{self.start: self.addedpiece}]
+
     @staticmethod
     def vector(start, end):
         x = end[0] - start[0]
@@ -71,13 +98,37 @@ class MoveError(Exception):
 
 
 class BasePiece:
-    def __init__(self,colour):
+    '''
+    Pieces are immutable and shared: Rook('white') always returns
+    the same object, so boards hold references to a dozen
+    pieces at most instead of creating their own.
+    Per-game state such as castling rights lives on the Board.
+    '''
+    __slots__ = ('colour',)
+    _instances = {}
+
+    def __new__(cls, colour):
+        piece = cls._instances.get((cls, colour))
+        if piece is not None:
+            return piece
         if type(colour) != str:
             raise TypeError('colour argument must be str')
         elif colour.lower() not in {'white','black'}:
             raise ValueError('colour must be {white,black}')
-        else:
-            self.colour = colour
+        piece = super().__new__(cls)
+        object.__setattr__(piece, 'colour', colour)
+        cls._instances[(cls, colour)] = piece
+        return piece
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(f'{type(self).__name__} is immutable')
+
+    def __reduce__(self):
+        # Unpickle to the shared instance of the receiving process
+        return (type(self), (self.colour,))
 
     def __repr__(self):
         return f'BasePiece({repr(self.colour)})'
@@ -88,23 +139,14 @@ class BasePiece:
         except NameError:
             return f'{self.colour} piece'
 
-    @staticmethod
-    def vector(start, end):
-        x = end[0] - start[0]
-        y = end[1] - start[1]
-        dist = abs(x) + abs(y)
-        return x, y, dist
-
 
 class King(BasePiece):
+    __slots__ = ()
     name = 'king'
+    symbol = 'k'
+    kind = 5
     def __repr__(self):
         return f'King({repr(self.colour)})'
-    
-    def isvalid(self, start: tuple, end: tuple):
-        '''King can move 1 step horizontally or vertically.'''
-        x, y, dist = self.vector(start, end)
-        return dist == 1
 
     def get_img(self):
         if self.colour == "white":
@@ -115,19 +157,13 @@ class King(BasePiece):
 
 
 class Queen(BasePiece):
+    __slots__ = ()
     name = 'queen'
+    symbol = 'q'
+    kind = 4
     def __repr__(self):
         return f'Queen({repr(self.colour)})'
 
-    def isvalid(self, start: tuple, end: tuple):
-        x, y, dist = self.vector(start, end)
-        if (x != 0 and y != 0 and abs(x) == abs(y)) \
-                or (x == 0 and y != 0) \
-                or (y == 0 and x != 0):
-            return True
-        else:
-            return False
-
     def get_img(self):
         if self.colour == "white":
             return "WQ"
@@ -135,17 +171,13 @@ class Queen(BasePiece):
             return "BQ"
 
 class Bishop(BasePiece):
+    __slots__ = ()
     name = 'bishop'
+    symbol = 'b'
+    kind = 2
     def __repr__(self):
         return f'Bishop({repr(self.colour)})'
 
-    def isvalid(self, start: tuple, end: tuple):
-        x, y, dist = self.vector(start, end)
-        if x != 0 and y != 0 and abs(x) == abs(y):
-            return True
-        else:
-            return False
-
     def get_img(self):
         if self.colour == "white":
             return "WB"
@@ -153,17 +185,13 @@ class Bishop(BasePiece):
             return "BB"
 
 class Knight(BasePiece):
+    __slots__ = ()
     name = 'knight'
+    symbol = 'n'
+    kind = 1
     def __repr__(self):
         return f'Knight({repr(self.colour)})'
 
-    def isvalid(self, start: tuple, end: tuple):
-        x, y, dist = self.vector(start, end)
-        if dist == 3 and 0 < abs(x) < 3 and 0 < abs(y) < 3:
-            return True
-        else:
-            return False
-
     def get_img(self):
         if self.colour == "white":
             return "WKnight"
@@ -172,29 +200,13 @@ class Knight(BasePiece):
 
 
 class Rook(BasePiece):
+    __slots__ = ()
     name = 'rook'
+    symbol = 'r'
+    kind = 3
     def __repr__(self):
         return f'Rook({repr(self.colour)})'
 
-    def isvalid(self, start: tuple, end: tuple, **kwargs):
-        x, y, dist = self.vector(start, end)
-        if kwargs.get('castling', False):
-            if self.colour == 'white':
-                row = 0
-            elif self.colour == 'black':
-                row = 7
-            if start[1] != end[1] != row:
-                return False
-            elif not((start[0] == 0 and end[0] == 3)
-                   or (start[0] == 7 and end[0] == 5)):
-                return False
-            else:
-                return True
-        else:
-            if (x == 0 and y != 0) or (y == 0 and x != 0):
-                return True
-            else:
-                return False
     def get_img(self):
         if self.colour == "white":
             return "WR"
@@ -203,19 +215,13 @@ class Rook(BasePiece):
 
 
 class Pawn(BasePiece):
+    __slots__ = ()
     name = 'pawn'
+    symbol = 'p'
+    kind = 0
     def __repr__(self):
         return f'Pawn({repr(self.colour)})'
 
-    def isvalid(self, start: tuple, end: tuple, **kwargs):
-        x, y, dist = self.vector(start, end)
-        xmove = 1 if kwargs.get('capture', False) else 0
-        if x == xmove:
-            if self.colour == 'black' and y == -1 \
-                    or self.colour == 'white' and y == 1:
-                return True
-        return False
-
     def get_img(self):
         if self.colour == "white":
             return "WP"
@@ -223,25 +229,327 @@ class Pawn(BasePiece):
             return "BP"
 
 
+# Squares are numbered 0-63 from (0, 0) to (7, 7), row by row,
+# so square = row * 8 + col.
+COLOURS = ('white', 'black')
+COLOUR_INDEX = {'white': 0, 'black': 1}
+
+
+def to_square(coord):
+    '''Convert a (col,row) tuple into a square number.'''
+    return coord[1] * 8 + coord[0]
+
+
+def to_coord(sq):
+    '''Convert a square number into a (col,row) tuple.'''
+    return (sq & 7, sq >> 3)
+
+
+def parse_move(text):
+    '''
+    The (start, end) (col,row) tuples of a move typed as in
+    Board.prompt(), e.g. '41 43', or None if `text` is not one.
+    '''
+    if not isinstance(text, str) or len(text) != 5 or text[2] != ' ' \
+            or not all(char in '01234567' for char in text[:2] + text[3:]):
+        return None
+    return (int(text[0]), int(text[1])), (int(text[3]), int(text[4]))
+
+
+def bitboard_index(piece):
+    '''Index of the bitboard holding `piece` (colour * 6 + kind).'''
+    return COLOUR_INDEX[piece.colour] * 6 + piece.kind
+
+
+def squares(bitboard):
+    '''Yield the square numbers of the set bits in `bitboard`.'''
+    while bitboard:
+        lsb = bitboard & -bitboard
+        yield lsb.bit_length() - 1
+        bitboard ^= lsb
+
+
+# Piece classes by kind, and kinds by piece name
+PIECE_CLASSES = (Pawn, Knight, Bishop, Rook, Queen, King)
+PIECE_KINDS = {cls.name: cls.kind for cls in PIECE_CLASSES}
+
+# The shared piece for each bitboard index
+PIECES = [cls(colour) for colour in COLOURS for cls in PIECE_CLASSES]
+
+# FEN letters: upper case for white, lower case for black
+FEN_PIECES = {piece.symbol.upper() if piece.colour == 'white'
+              else piece.symbol: piece for piece in PIECES}
+
+# Squares of row 0 and row 7
+FIRST_ROW = 0xFF
+LAST_ROW = 0xFF << 56
+
+
+# Moves inside the engine are packed ints:
+# start | end << 6 | flag << 12
+NORMAL = 0
+DOUBLE_PUSH = 1
+CASTLING = 2
+EN_PASSANT = 3
+PROMOTIONS = {4: Knight, 5: Bishop, 6: Rook, 7: Queen}
+PROMOTION_FLAGS = {cls.kind: flag for flag, cls in PROMOTIONS.items()}
+
+# Castling rights bits
+WHITE_KINGSIDE = 1
+WHITE_QUEENSIDE = 2
+BLACK_KINGSIDE = 4
+BLACK_QUEENSIDE = 8
+
+FEN_CASTLING = (('K', WHITE_KINGSIDE), ('Q', WHITE_QUEENSIDE),
+                ('k', BLACK_KINGSIDE), ('q', BLACK_QUEENSIDE))
+
+# Castling right -> (king square, rook square) it needs
+CASTLING_HOMES = {WHITE_KINGSIDE: (4, 7), WHITE_QUEENSIDE: (4, 0),
+                  BLACK_KINGSIDE: (60, 63), BLACK_QUEENSIDE: (60, 56)}
+
+# Rights kept when a piece moves from or to each square
+CASTLING_MASKS = [15] * 64
+CASTLING_MASKS[0] = 15 & ~WHITE_QUEENSIDE
+CASTLING_MASKS[4] = 15 & ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLING_MASKS[7] = 15 & ~WHITE_KINGSIDE
+CASTLING_MASKS[56] = 15 & ~BLACK_QUEENSIDE
+CASTLING_MASKS[60] = 15 & ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLING_MASKS[63] = 15 & ~BLACK_KINGSIDE
+
+# King destination -> (rook start, rook end)
+CASTLING_ROOKS = {6: (7, 5), 2: (0, 3), 62: (63, 61), 58: (56, 59)}
+
+KNIGHT_STEPS = ((1, 2), (2, 1), (2, -1), (1, -2),
+                (-1, -2), (-2, -1), (-2, 1), (-1, 2))
+KING_STEPS = ((1, 0), (1, 1), (0, 1), (-1, 1),
+              (-1, 0), (-1, -1), (0, -1), (1, -1))
+ROOK_DIRECTIONS = ((1, 0), (0, 1), (-1, 0), (0, -1))
+BISHOP_DIRECTIONS = ((1, 1), (-1, 1), (-1, -1), (1, -1))
+
+
+def _step_table(steps):
+    '''Bitboard of the squares one of `steps` away, for each square.'''
+    table = []
+    for sq in range(64):
+        col, row = sq & 7, sq >> 3
+        bits = 0
+        for dcol, drow in steps:
+            c, r = col + dcol, row + drow
+            if 0 <= c < 8 and 0 <= r < 8:
+                bits |= 1 << (r * 8 + c)
+        table.append(bits)
+    return tuple(table)
+
+
+def _ray_table(dcol, drow):
+    '''
+    Bitboard of the squares from each square to the edge of the
+    board in direction (dcol, drow), not counting the square.
+    '''
+    table = []
+    for sq in range(64):
+        c, r = (sq & 7) + dcol, (sq >> 3) + drow
+        bits = 0
+        while 0 <= c < 8 and 0 <= r < 8:
+            bits |= 1 << (r * 8 + c)
+            c, r = c + dcol, r + drow
+        table.append(bits)
+    return tuple(table)
+
+
+# Attack tables, by square: the squares a knight or king there
+# attacks, and those a pawn there attacks by colour index
+KNIGHT_ATTACKS = _step_table(KNIGHT_STEPS)
+KING_ATTACKS = _step_table(KING_STEPS)
+PAWN_ATTACKS = (_step_table(((-1, 1), (1, 1))),
+                _step_table(((-1, -1), (1, -1))))
+
+# Sliding rays as (table by square, whether the ray runs towards
+# higher square numbers), which says whether the nearest piece on
+# a ray is its lowest or highest set bit
+ROOK_RAYS = tuple((_ray_table(dcol, drow), drow > 0 or drow == 0 < dcol)
+                  for dcol, drow in ROOK_DIRECTIONS)
+BISHOP_RAYS = tuple((_ray_table(dcol, drow), drow > 0)
+                    for dcol, drow in BISHOP_DIRECTIONS)
+
+# Every square a rook or bishop could reach on an empty board
+ROOK_LINES = tuple(sum(table[sq] for table, _ in ROOK_RAYS)
+                   for sq in range(64))
+BISHOP_LINES = tuple(sum(table[sq] for table, _ in BISHOP_RAYS)
+                     for sq in range(64))
+
+
+def slider_attacks(sq, occupied, rays):
+    '''
+    Bitboard of the squares attacked from `sq` along `rays`
+    (ROOK_RAYS or BISHOP_RAYS): each ray stops at, and includes,
+    the first square set in `occupied`.
+    '''
+    attacks = 0
+    for table, ascending in rays:
+        ray = table[sq]
+        blockers = ray & occupied
+        if blockers:
+            if ascending:
+                first = (blockers & -blockers).bit_length() - 1
+            else:
+                first = blockers.bit_length() - 1
+            ray ^= table[first]
+        attacks |= ray
+    return attacks
+
+
+def between(a, b):
+    '''
+    Bitboard of the squares strictly between squares `a` and `b`
+    if they share a row, column or diagonal, else 0.
+    '''
+    for table, _ in ROOK_RAYS + BISHOP_RAYS:
+        if table[a] >> b & 1:
+            return table[a] & ~table[b] & ~(1 << b)
+    return 0
+
+
+# Zobrist keys: a fixed random 64-bit number per (bitboard index,
+# square), for black to move, per set of castling rights and per
+# en passant column. A position's key is the XOR of its features.
+_random = random.Random(20200824)
+ZOBRIST_PIECES = [_random.getrandbits(64) for _ in range(12 * 64)]
+ZOBRIST_BLACK = _random.getrandbits(64)
+ZOBRIST_CASTLING = [0] + [_random.getrandbits(64) for _ in range(15)]
+ZOBRIST_EN_PASSANT = [_random.getrandbits(64) for _ in range(8)]
+del _random
+
+
+# Centipawn values by piece kind (pawn, knight, bishop, rook, queen, king)
+PIECE_VALUES = (100, 320, 330, 500, 900, 0)
+
+# Piece-square bonuses for white, drawn as the board is seen from
+# white's side (row 7 at the top). Black uses the mirror image.
+PIECE_SQUARE_TABLES = (
+    (  0,   0,   0,   0,   0,   0,   0,   0,   # pawn
+      50,  50,  50,  50,  50,  50,  50,  50,
+      10,  10,  20,  30,  30,  20,  10,  10,
+       5,   5,  10,  25,  25,  10,   5,   5,
+       0,   0,   0,  20,  20,   0,   0,   0,
+       5,  -5, -10,   0,   0, -10,  -5,   5,
+       5,  10,  10, -20, -20,  10,  10,   5,
+       0,   0,   0,   0,   0,   0,   0,   0),
+    (-50, -40, -30, -30, -30, -30, -40, -50,  # knight
+     -40, -20,   0,   0,   0,   0, -20, -40,
+     -30,   0,  10,  15,  15,  10,   0, -30,
+     -30,   5,  15,  20,  20,  15,   5, -30,
+     -30,   0,  15,  20,  20,  15,   0, -30,
+     -30,   5,  10,  15,  15,  10,   5, -30,
+     -40, -20,   0,   5,   5,   0, -20, -40,
+     -50, -40, -30, -30, -30, -30, -40, -50),
+    (-20, -10, -10, -10, -10, -10, -10, -20,  # bishop
+     -10,   0,   0,   0,   0,   0,   0, -10,
+     -10,   0,   5,  10,  10,   5,   0, -10,
+     -10,   5,   5,  10,  10,   5,   5, -10,
+     -10,   0,  10,  10,  10,  10,   0, -10,
+     -10,  10,  10,  10,  10,  10,  10, -10,
+     -10,   5,   0,   0,   0,   0,   5, -10,
+     -20, -10, -10, -10, -10, -10, -10, -20),
+    (  0,   0,   0,   0,   0,   0,   0,   0,   # rook
+       5,  10,  10,  10,  10,  10,  10,   5,
+      -5,   0,   0,   0,   0,   0,   0,  -5,
+      -5,   0,   0,   0,   0,   0,   0,  -5,
+      -5,   0,   0,   0,   0,   0,   0,  -5,
+      -5,   0,   0,   0,   0,   0,   0,  -5,
+      -5,   0,   0,   0,   0,   0,   0,  -5,
+       0,   0,   0,   5,   5,   0,   0,   0),
+    (-20, -10, -10,  -5,  -5, -10, -10, -20,  # queen
+     -10,   0,   0,   0,   0,   0,   0, -10,
+     -10,   0,   5,   5,   5,   5,   0, -10,
+      -5,   0,   5,   5,   5,   5,   0,  -5,
+       0,   0,   5,   5,   5,   5,   0,  -5,
+     -10,   5,   5,   5,   5,   5,   0, -10,
+     -10,   0,   5,   0,   0,   0,   0, -10,
+     -20, -10, -10,  -5,  -5, -10, -10, -20),
+    (-30, -40, -40, -50, -50, -40, -40, -30,  # king
+     -30, -40, -40, -50, -50, -40, -40, -30,
+     -30, -40, -40, -50, -50, -40, -40, -30,
+     -30, -40, -40, -50, -50, -40, -40, -30,
+     -20, -30, -30, -40, -40, -30, -30, -20,
+     -10, -20, -20, -20, -20, -20, -20, -10,
+      20,  20,   0,   0,   0,   0,  20,  20,
+      20,  30,  10,   0,   0,  10,  30,  20),
+)
+
+# Score of each piece on each square, indexed like ZOBRIST_PIECES:
+# value plus piece-square bonus, positive for white, negative for black
+PIECE_SCORES = [0] * (12 * 64)
+for _kind, _table in enumerate(PIECE_SQUARE_TABLES):
+    for _sq in range(64):
+        # The tables list row 7 first
+        _bonus = _table[(7 - (_sq >> 3)) * 8 + (_sq & 7)]
+        PIECE_SCORES[_kind * 64 + _sq] = PIECE_VALUES[_kind] + _bonus
+        PIECE_SCORES[(6 + _kind) * 64 + (_sq ^ 56)] = \
+            -(PIECE_VALUES[_kind] + _bonus)
+del _kind, _table, _sq, _bonus
+
+
+def uci(move):
+    '''Name a packed move in long algebraic notation, e.g. e2e4.'''
+    start, end, flag = move & 63, move >> 6 & 63, move >> 12
+    name = ''
+    for sq in (start, end):
+        name += 'abcdefgh'[sq & 7] + str((sq >> 3) + 1)
+    if flag in PROMOTIONS:
+        name += PROMOTIONS[flag].symbol
+    return name
+
+
 class Board:
     '''
+    The position is stored twice: as twelve 64-bit bitboards, one per
+    colour and piece kind (see bitboard_index()), and as a 64-entry
+    mailbox list of pieces indexed by square. Two more bitboards hold
+    the squares of each colour's pieces. All are only changed through
+    add() and remove(), so questions like "where is the king" or
+    "which pawns can promote" never need a scan of the board.
+
     ATTRIBUTES
 
     turn <{'white', 'black'}>
         The current player's colour.
     
-    winner <{'white', 'black', None}>
+    winner <{'white', 'black', 'draw', None}>
         The winner (if game has ended).
+        'draw' if the game ended in stalemate.
         If game has not ended, returns None
 
     checkmate <{'white', 'black', None}>
         Whether any player is checkmated.
 
+    castling <int>
+        Castling rights, a combination of WHITE_KINGSIDE,
+        WHITE_QUEENSIDE, BLACK_KINGSIDE and BLACK_QUEENSIDE.
+
+    en_passant <int or None>
+        The square a pawn may capture onto en passant.
+
+    halfmove_clock <int>
+        Moves since the last capture or pawn move.
+
+    fullmove_number <int>
+        Starts at 1 and goes up after each black move.
+
+    hash <int>
+        64-bit Zobrist key of the position, including the side
+        to move, castling rights and en passant column. Kept up
+        to date as the board changes.
+
     METHODS
     
     start()
         Start a game. White goes first.
 
+    from_fen(fen), to_fen()
+        Set up a new Board from / describe this one in
+        Forsyth-Edwards Notation.
+
     display()
         Print the game board.
 
@@ -251,58 +559,351 @@ class Board:
     next_turn()
         Go on to the next player's turn.
 
-    isvalid(start, end)
-        Checks if the move (start -> end) is valid for this turn.
+    is_attacked(square, colour), in_check(colour)
+        Whether `colour` attacks a square / has its king attacked.
+
+    is_legal(start, end), legal_targets()
+        Whether a move is legal this turn / every square each of
+        the current player's pieces can move to.
 
     update(start, end)
         Carries out the move (start -> end) and updates the board.
+
+    legal_moves()
+        Generates every legal move for this turn.
+
+    perft(depth)
+        Counts the legal move paths `depth` plies deep.
+
+    evaluate()
+        Material and piece-square score in centipawns.
     '''
     def __init__(self, **kwargs):
         self.debug = kwargs.get('debug', False)
-        self._position = {}
+        self._bitboards = [0] * 12
+        self._occupancy = [0, 0]
+        self._mailbox = [None] * 64
+        self.hash = 0
+        self._score = 0
+        self._turn = 'white'
+        self._castling = 0
+        self._en_passant = None
+        self.halfmove_clock = 0
+        self.fullmove_number = 1
         self.winner = None
         self.checkmate = None
         self.info = None
-        self.movehistory = MoveHistory(10)
+        self.movehistory = MoveHistory()
+        self._legal = (None, None)  # (hash, moves) of the last _legal_moves()
+        self._by_key = (None, None)  # the same moves, by start and end
+
     def undo(self, move):
-        added_pieces = move.added
-        removed_pieces = move.removed
-        for dict_ in removed_pieces:
-            for coord, piece in dict_.items():
-                if piece is not None:
-                    self.add(coord, piece)
-        for dict_2 in added_pieces:
-            for coord in dict_2.keys():
-                self.remove(coord)
-            
-    
+        '''
+        Take back `move`, the last move popped from movehistory.
+        The turn is not changed.
+        '''
+        code, state = self._unpack(move)
+        self._unmake(code, state)
+        self.halfmove_clock = move >> 35 & 1023
+        if state[0].colour == 'black':
+            self.fullmove_number -= 1
+        self.winner = None
+        self.checkmate = None
+
+    def redo(self):
+        '''
+        Play the last undone move again and return it.
+        The turn is not changed.
+        '''
+        move = self.movehistory.redo()
+        self._count(self._make(move & 0xFFFF))
+        return move
+
+    def _play(self, move):
+        '''
+        Play a packed move without any checks and record it
+        in movehistory. The turn is not changed.
+        '''
+        clock = self.halfmove_clock
+        state = self._make(move)
+        self._count(state)
+        self.movehistory.push(self._pack(move, state, clock))
+
+    def _count(self, state):
+        '''Advance the move counters past a move made by _make().'''
+        piece, captured = state[0], state[1]
+        if captured is not None or piece.kind == Pawn.kind:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        if piece.colour == 'black':
+            self.fullmove_number += 1
+
+    def goto(self, ply):
+        '''
+        Undo or redo moves until the first `ply` moves of the game
+        are on the board, switching turns as it goes.
+        '''
+        history = self.movehistory
+        if not 0 <= ply <= len(history) + history.undone():
+            raise IndexError(f'No ply {ply} in this game.')
+        while len(history) > ply:
+            self.undo(history.pop())
+            self._switch_turn()
+        while len(history) < ply:
+            self.redo()
+            self._switch_turn()
+
+    @staticmethod
+    def _pack(move, state, clock=0):
+        '''
+        Pack a move, its _make() state and the halfmove clock
+        before the move into one int:
+        bits 0-15   the move (start, end, flag)
+        bits 16-19  bitboard index of the moving piece
+        bits 20-23  bitboard index + 1 of the captured piece, or 0
+        bits 24-27  castling rights before the move
+        bits 28-34  en passant square + 1 before the move, or 0
+        bits 35-44  halfmove clock before the move (at most 1023)
+        '''
+        piece, captured, castling, en_passant = state
+        packed = move | bitboard_index(piece) << 16 | castling << 24 \
+            | min(clock, 1023) << 35
+        if captured is not None:
+            packed |= (bitboard_index(captured) + 1) << 20
+        if en_passant is not None:
+            packed |= (en_passant + 1) << 28
+        return packed
+
+    @staticmethod
+    def _unpack(packed):
+        '''Inverse of _pack(): returns (move, state).'''
+        captured = packed >> 20 & 15
+        en_passant = packed >> 28 & 127
+        state = (PIECES[packed >> 16 & 15],
+                 PIECES[captured - 1] if captured else None,
+                 packed >> 24 & 15,
+                 en_passant - 1 if en_passant else None)
+        return packed & 0xFFFF, state
+
+
+    @property
+    def turn(self):
+        return self._turn
+
+    @turn.setter
+    def turn(self, colour):
+        if colour != self._turn:
+            self.hash ^= ZOBRIST_BLACK
+        self._turn = colour
+
+    @property
+    def castling(self):
+        return self._castling
+
+    @castling.setter
+    def castling(self, rights):
+        self.hash ^= ZOBRIST_CASTLING[self._castling] \
+            ^ ZOBRIST_CASTLING[rights]
+        self._castling = rights
+
+    @property
+    def en_passant(self):
+        return self._en_passant
+
+    @en_passant.setter
+    def en_passant(self, sq):
+        if self._en_passant is not None:
+            self.hash ^= ZOBRIST_EN_PASSANT[self._en_passant & 7]
+        if sq is not None:
+            self.hash ^= ZOBRIST_EN_PASSANT[sq & 7]
+        self._en_passant = sq
+
+    def evaluate(self):
+        '''
+        Material plus piece-square score of the position in
+        centipawns; positive favours white, negative black.
+        Kept up to date by add() and remove(), so this is O(1).
+        '''
+        return self._score
+
+    def copy(self):
+        '''
+        A new Board with the same position, turn, castling rights
+        and en passant square, but no move history.
+        '''
+        board = Board(debug=self.debug)
+        board._bitboards = self._bitboards[:]
+        board._occupancy = self._occupancy[:]
+        board._mailbox = self._mailbox[:]
+        board.hash = self.hash
+        board._score = self._score
+        board._turn = self._turn
+        board._castling = self._castling
+        board._en_passant = self._en_passant
+        board.halfmove_clock = self.halfmove_clock
+        board.fullmove_number = self.fullmove_number
+        board._legal = self._legal
+        board._by_key = self._by_key
+        return board
+
+    @classmethod
+    def from_fen(cls, fen):
+        '''
+        A new Board set up from a FEN string. The halfmove clock
+        and fullmove number may be left out.
+
+        Raises:
+        ValueError if `fen` is not a valid position
+        '''
+        fields = fen.split()
+        if len(fields) not in (4, 6):
+            raise ValueError('FEN needs 4 or 6 fields')
+        placement, turn, castling, en_passant = fields[:4]
+        board = cls()
+        rows = placement.split('/')
+        if len(rows) != 8:
+            raise ValueError('FEN placement needs 8 rows')
+        for row, rank in zip(range(7, -1, -1), rows):
+            col = 0
+            for char in rank:
+                if char in '12345678':
+                    col += int(char)
+                elif char in FEN_PIECES and col < 8:
+                    board._put(row * 8 + col, FEN_PIECES[char])
+                    col += 1
+                else:
+                    raise ValueError(f'Bad FEN row {rank!r}')
+            if col != 8:
+                raise ValueError(f'Bad FEN row {rank!r}')
+        for colour in COLOURS:
+            if bin(board._bitboards[COLOUR_INDEX[colour] * 6
+                                    + King.kind]).count('1') != 1:
+                raise ValueError(f'FEN needs one {colour} king')
+        if board._bitboards[Pawn.kind] & (FIRST_ROW | LAST_ROW) \
+                or board._bitboards[6 + Pawn.kind] & (FIRST_ROW | LAST_ROW):
+            raise ValueError('FEN has a pawn on the first or last row')
+        if turn not in ('w', 'b'):
+            raise ValueError(f'Bad FEN side to move {turn!r}')
+        board.turn = 'white' if turn == 'w' else 'black'
+        us = COLOUR_INDEX[board.turn]
+        if board._in_check(1 - us):
+            raise ValueError('FEN side not to move is in check')
+        bitboards = board._bitboards
+        if castling != '-':
+            rights = dict(FEN_CASTLING)
+            for char in castling:
+                if char not in rights:
+                    raise ValueError(f'Bad FEN castling rights {castling!r}')
+                right = rights[char]
+                king, rook = CASTLING_HOMES[right]
+                base = 0 if char.isupper() else 6
+                if not (bitboards[base + King.kind] >> king & 1
+                        and bitboards[base + Rook.kind] >> rook & 1):
+                    raise ValueError(f'FEN castling right {char!r} needs '
+                                     'the king and rook at home')
+                board.castling |= right
+        if en_passant != '-':
+            # The square a pawn of the side not to move just skipped
+            row = '63'[us]
+            if len(en_passant) != 2 or en_passant[0] not in 'abcdefgh' \
+                    or en_passant[1] != row:
+                raise ValueError(f'Bad FEN en passant square {en_passant!r}')
+            sq = (int(row) - 1) * 8 + 'abcdefgh'.index(en_passant[0])
+            forward = 8 if us == 0 else -8
+            occupied = board.occupied()
+            if not bitboards[(1 - us) * 6 + Pawn.kind] >> sq - forward & 1 \
+                    or (occupied >> sq | occupied >> sq + forward) & 1:
+                raise ValueError(f'FEN en passant square {en_passant!r} '
+                                 'has no pawn that could have just moved')
+            board.en_passant = sq
+        if len(fields) == 6:
+            if not (fields[4].isdigit() and fields[5].isdigit()):
+                raise ValueError('Bad FEN move counters')
+            board.halfmove_clock = int(fields[4])
+            board.fullmove_number = max(1, int(fields[5]))
+        return board
+
+    def to_fen(self):
+        '''The position in Forsyth-Edwards Notation.'''
+        rows = []
+        for row in range(7, -1, -1):
+            rank = ''
+            empty = 0
+            for piece in self._mailbox[row * 8:row * 8 + 8]:
+                if piece is None:
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                symbol = piece.symbol
+                rank += symbol.upper() if piece.colour == 'white' else symbol
+            if empty:
+                rank += str(empty)
+            rows.append(rank)
+        castling = ''.join(char for char, right in FEN_CASTLING
+                           if self._castling & right) or '-'
+        en_passant = '-'
+        if self._en_passant is not None:
+            en_passant = 'abcdefgh'[self._en_passant & 7] \
+                + str((self._en_passant >> 3) + 1)
+        return ' '.join(('/'.join(rows), self._turn[0], castling, en_passant,
+                         str(self.halfmove_clock), str(self.fullmove_number)))
+
+    def occupied(self):
+        '''Bitboard of all occupied squares.'''
+        return self._occupancy[0] | self._occupancy[1]
+
+    def king_square(self, colour):
+        '''The (col,row) of `colour`'s king, or None if it has none.'''
+        kings = self._bitboards[COLOUR_INDEX[colour] * 6 + King.kind]
+        if not kings:
+            return None
+        return to_coord(kings.bit_length() - 1)
+
     def coords(self):
-        return list(self._position.keys())
+        return [to_coord(sq) for sq in squares(self.occupied())]
 
     def pieces(self):
-        return list(self._position.values())
+        return [self._mailbox[sq] for sq in squares(self.occupied())]
 
     def add(self, coord: tuple, piece):
-        self._position[coord] = piece
+        sq = to_square(coord)
+        if self._mailbox[sq] is not None:
+            self._take(sq)
+        self._put(sq, piece)
 
     def move(self, start, end):
         piece = self.get_piece(start)
         self.remove(start)
         self.add(end, piece)
-        self.get_piece(end).notmoved = False
+        self.castling &= CASTLING_MASKS[to_square(start)] \
+            & CASTLING_MASKS[to_square(end)]
 
     def remove(self, pos):
-        del self._position[pos]
-
-    def castle(self, start, end):
-        '''Carry out castling move (assuming move is validated)'''
-        self.move(start, end)
-        # Move the king
-        row = start[1]
-        if start[0] == 0:
-            self.move((4, row), (2, row))
-        elif start[0] == 7:
-            self.move((4, row), (6, row))
+        sq = to_square(pos)
+        if self._mailbox[sq] is None:
+            raise KeyError(pos)
+        self._take(sq)
+
+    def _put(self, sq, piece):
+        index = bitboard_index(piece)
+        self._mailbox[sq] = piece
+        self._bitboards[index] |= 1 << sq
+        self._occupancy[index >= 6] |= 1 << sq
+        self.hash ^= ZOBRIST_PIECES[index * 64 + sq]
+        self._score += PIECE_SCORES[index * 64 + sq]
+
+    def _take(self, sq):
+        piece = self._mailbox[sq]
+        index = bitboard_index(piece)
+        self._mailbox[sq] = None
+        self._bitboards[index] &= ~(1 << sq)
+        self._occupancy[index >= 6] &= ~(1 << sq)
+        self.hash ^= ZOBRIST_PIECES[index * 64 + sq]
+        self._score -= PIECE_SCORES[index * 64 + sq]
+        return piece
 
     def get_piece(self, coord):
         '''
@@ -314,98 +915,349 @@ class Board:
         BasePiece instance
         or None if no piece found
         '''
-        return self._position.get(coord, None)
+        col, row = coord
+        if 0 <= col < 8 and 0 <= row < 8:
+            return self._mailbox[row * 8 + col]
+        return None
 
     def alive(self, colour, name):
-        for piece in self.pieces():
-            if piece.colour == colour and piece.name == name:
-                return True
-        return False
-    
+        return self._bitboards[COLOUR_INDEX[colour] * 6
+                               + PIECE_KINDS[name]] != 0
+
     def promotepawns(self, PieceClass=None):
-        for coord in self.coords():
-            row = coord[1]
-            piece = self.get_piece(coord)
-            for opprow, colour in zip([0, 7], ['black', 'white']):
-                if row == opprow and piece.name == 'pawn' \
-                        and piece.colour == colour:
-                    print(PieceClass)
-                    if PieceClass is None:
-                        return True
-                    else:
-                        promoted_piece = PieceClass(colour)
-                        self.info = f"Promoted pawn at {coord} to {promoted_piece.name}"
-                        self.remove(coord)
-                        self.add(coord, promoted_piece)
-
-    def king_and_rook_unmoved(self, colour, rook_coord):
-        row = rook_coord[1]
-        king = self.get_piece((4, row))
-        rook = self.get_piece(rook_coord)
-        return king.notmoved and rook.notmoved
-
-    def no_pieces_between_king_and_rook(self, colour, rook_coord):
-        row = rook_coord[1]
-        rook_col = rook_coord[0]
-        if rook_col == 0:
-            columns = (1, 2, 3)
-        elif rook_col == 7:
-            columns = (5, 6)
-        else:
-            raise MoveError('Invalid move: castling from {rook_coord}')
-        for col in columns:
-            if self.get_piece((col, row)) is not None:
-                return False
-        return True
+        pawns = self._bitboards[Pawn.kind] & LAST_ROW \
+            | self._bitboards[6 + Pawn.kind] & FIRST_ROW
+        for sq in squares(pawns):
+            coord = to_coord(sq)
+            colour = self._mailbox[sq].colour
+            if PieceClass is None:
+                return True
+            else:
+                promoted_piece = PieceClass(colour)
+                self.info = f"Promoted pawn at {coord} to {promoted_piece.name}"
+                self.remove(coord)
+                self.add(coord, promoted_piece)
+                self._record_promotion(sq, promoted_piece)
+
+    def _record_promotion(self, sq, piece):
+        '''Note a promotion chosen after update() in the last move.'''
+        if self.movehistory.empty():
+            return
+        last = self.movehistory[-1]
+        if last >> 6 & 63 == sq and last >> 12 & 15 == NORMAL \
+                and PIECES[last >> 16 & 15].kind == Pawn.kind:
+            self.movehistory.amend(last | PROMOTION_FLAGS[piece.kind] << 12)
 
     def movetype(self, start, end):
         '''
-        Determines the type of board move by:
-        1. Checking if the player is moving a piece of their
-           own colour
-        2. Checking if the piece at `start` and the piece at
-           `end` are the same colour
-        3. Checking if the move is valid for that piece type
+        Determines the type of board move by looking it up
+        among the legal moves for this turn.
 
         Returns:
         'move' for normal moves
         'capture' for captures
-        'castling' for rook castling
+        'castling' for castling (the king moves two squares)
+        'enpassant' for en passant captures
         None for invalid moves
         '''
         if self.debug:
-            print(f'== movetype({start}, {end}) ==')
+            logger.debug('movetype(%s, %s)', start, end)
         if start is None or end is None:
             return None
-        start_piece = self.get_piece(start)
-        end_piece = self.get_piece(end)
         if self.debug:
-            print(f'START_PIECE: {start_piece}')
-            print(f'END_PIECE: {end_piece}')
-        if start_piece is None \
-                or start_piece.colour != self.turn:
+            logger.debug('start piece %s, end piece %s',
+                         self.get_piece(start), self.get_piece(end))
+        move = self._find_move(start, end)
+        if move is None:
             return None
-        if end_piece is not None:
-            if end_piece.colour != start_piece.colour:
-                return 'capture'
-            # handle special cases
-            elif start_piece.name == 'pawn' \
-                    and end_piece.colour != start_piece.colour \
-                    and start_piece.isvalid(start, end, capture=True):
-                return 'capture'
-            else:
-                return None
-        else:  # end piece is None
-            if start_piece.name == 'rook' \
-                    and start_piece.isvalid(start, end, castling=True) \
-                    and self.king_and_rook_unmoved(self.turn, start) \
-                    and self.no_pieces_between_king_and_rook(self.turn, start):
-                return 'castling'
-            elif start_piece.isvalid(start, end):
-                return 'move'
+        return self._classify(move)
+
+    def _find_move(self, start, end, promotion=None):
+        '''
+        Find the legal packed move for start -> end.
+        If the move promotes a pawn and `promotion` is None, the
+        pawn is left on the last row for promotepawns().
+
+        Return:
+        packed move int
+        or None if the move is not legal
+        '''
+        key = to_square(start) | to_square(end) << 6
+        for move in self._legal_by_key().get(key, ()):
+            flag = move >> 12
+            if flag not in PROMOTIONS:
+                return move
+            if promotion is None:
+                return key
+            if PROMOTIONS[flag].kind == promotion.kind:
+                return move
+        return None
+
+    def _classify(self, move):
+        flag = move >> 12
+        if flag == CASTLING:
+            return 'castling'
+        elif flag == EN_PASSANT:
+            return 'enpassant'
+        elif self._mailbox[move >> 6 & 63] is not None:
+            return 'capture'
+        else:
+            return 'move'
+
+    def _make(self, move):
+        '''
+        Play a packed move on the board without any checks.
+        The turn is not changed.
+
+        Returns the state needed by _unmake().
+        '''
+        start, end, flag = move & 63, move >> 6 & 63, move >> 12
+        piece = self._mailbox[start]
+        if flag == EN_PASSANT:
+            target = end - 8 if piece.colour == 'white' else end + 8
+        else:
+            target = end
+        captured = self._mailbox[target]
+        state = (piece, captured, self._castling, self._en_passant)
+        if captured is not None:
+            self._take(target)
+        self._take(start)
+        if flag in PROMOTIONS:
+            self._put(end, PROMOTIONS[flag](piece.colour))
+        else:
+            self._put(end, piece)
+        if flag == CASTLING:
+            rook_start, rook_end = CASTLING_ROOKS[end]
+            self._put(rook_end, self._take(rook_start))
+        self.castling = self._castling \
+            & CASTLING_MASKS[start] & CASTLING_MASKS[end]
+        if flag == DOUBLE_PUSH:
+            self.en_passant = (start + end) // 2
+        elif self._en_passant is not None:
+            self.en_passant = None
+        return state
+
+    def _unmake(self, move, state):
+        '''Take back a packed move played by _make().'''
+        start, end, flag = move & 63, move >> 6 & 63, move >> 12
+        piece, captured, castling, en_passant = state
+        if flag == CASTLING:
+            rook_start, rook_end = CASTLING_ROOKS[end]
+            self._put(rook_start, self._take(rook_end))
+        self._take(end)
+        self._put(start, piece)
+        if captured is not None:
+            if flag == EN_PASSANT:
+                target = end - 8 if piece.colour == 'white' else end + 8
             else:
-                return None
-        return True
+                target = end
+            self._put(target, captured)
+        if castling != self._castling:
+            self.castling = castling
+        if en_passant != self._en_passant:
+            self.en_passant = en_passant
+
+    def _attacked(self, sq, by):
+        '''Whether square `sq` is attacked by colour index `by`.'''
+        bitboards = self._bitboards
+        base = by * 6
+        # A pawn attacks sq if a pawn of the other colour on sq
+        # would attack it back
+        if PAWN_ATTACKS[1 - by][sq] & bitboards[base + Pawn.kind] \
+                or KNIGHT_ATTACKS[sq] & bitboards[base + Knight.kind] \
+                or KING_ATTACKS[sq] & bitboards[base + King.kind]:
+            return True
+        queens = bitboards[base + Queen.kind]
+        occupied = self._occupancy[0] | self._occupancy[1]
+        rooks = bitboards[base + Rook.kind] | queens
+        if ROOK_LINES[sq] & rooks \
+                and slider_attacks(sq, occupied, ROOK_RAYS) & rooks:
+            return True
+        bishops = bitboards[base + Bishop.kind] | queens
+        return bool(BISHOP_LINES[sq] & bishops
+                    and slider_attacks(sq, occupied, BISHOP_RAYS) & bishops)
+
+    def _in_check(self, us):
+        '''Whether colour index `us` has its king attacked.'''
+        kings = self._bitboards[us * 6 + King.kind]
+        return bool(kings) \
+            and self._attacked(kings.bit_length() - 1, 1 - us)
+
+    def is_attacked(self, square, colour):
+        '''Whether `colour` attacks `square`, a (col,row) tuple.'''
+        return self._attacked(to_square(square), COLOUR_INDEX[colour])
+
+    def in_check(self, colour):
+        '''Whether `colour`'s king is attacked.'''
+        return self._in_check(COLOUR_INDEX[colour])
+
+    def _pseudo_moves(self, us):
+        '''
+        Packed moves for colour index `us`, ignoring whether
+        they leave the king in check.
+        '''
+        bitboards = self._bitboards
+        own = self._occupancy[us]
+        theirs = self._occupancy[1 - us]
+        occupied = own | theirs
+        moves = []
+
+        # Pawns
+        forward = 8 if us == 0 else -8
+        start_row = 1 if us == 0 else 6
+        last_row = 7 if us == 0 else 0
+        en_passant = self.en_passant
+        for sq in squares(bitboards[us * 6 + Pawn.kind]):
+            row = sq >> 3
+            if row == last_row:
+                continue
+            ahead = sq + forward
+            targets = []
+            if not occupied >> ahead & 1:
+                targets.append(ahead)
+                if row == start_row \
+                        and not occupied >> (ahead + forward) & 1:
+                    moves.append(sq | (ahead + forward) << 6
+                                 | DOUBLE_PUSH << 12)
+            attacks = PAWN_ATTACKS[us][sq]
+            targets.extend(squares(attacks & theirs))
+            if en_passant is not None and attacks >> en_passant & 1:
+                moves.append(sq | en_passant << 6 | EN_PASSANT << 12)
+            for target in targets:
+                if target >> 3 == last_row:
+                    for flag in PROMOTIONS:
+                        moves.append(sq | target << 6 | flag << 12)
+                else:
+                    moves.append(sq | target << 6)
+
+        # Knights and kings
+        for table, kind in ((KNIGHT_ATTACKS, Knight.kind),
+                            (KING_ATTACKS, King.kind)):
+            for sq in squares(bitboards[us * 6 + kind]):
+                for target in squares(table[sq] & ~own):
+                    moves.append(sq | target << 6)
+
+        # Sliding pieces
+        queens = bitboards[us * 6 + Queen.kind]
+        for rays, sliders in (
+                (ROOK_RAYS, bitboards[us * 6 + Rook.kind] | queens),
+                (BISHOP_RAYS, bitboards[us * 6 + Bishop.kind] | queens)):
+            for sq in squares(sliders):
+                for target in squares(slider_attacks(sq, occupied, rays)
+                                      & ~own):
+                    moves.append(sq | target << 6)
+
+        # Castling
+        if us == 0:
+            rights = self.castling & (WHITE_KINGSIDE | WHITE_QUEENSIDE)
+            kingside, home = WHITE_KINGSIDE, 4
+        else:
+            rights = self.castling & (BLACK_KINGSIDE | BLACK_QUEENSIDE)
+            kingside, home = BLACK_KINGSIDE, 60
+        king = self._mailbox[home]
+        if rights and king is not None and king.kind == King.kind \
+                and COLOUR_INDEX[king.colour] == us \
+                and not self._attacked(home, 1 - us):
+            for target in (home + 2, home - 2):
+                if target > home and not rights & kingside \
+                        or target < home and not rights & ~kingside:
+                    continue
+                rook_start, rook_end = CASTLING_ROOKS[target]
+                rook = self._mailbox[rook_start]
+                if rook is None or rook.kind != Rook.kind \
+                        or COLOUR_INDEX[rook.colour] != us:
+                    continue
+                if between(home, rook_start) & occupied \
+                        or self._attacked(rook_end, 1 - us):
+                    continue
+                moves.append(home | target << 6 | CASTLING << 12)
+        return moves
+
+    def _legal_moves(self):
+        '''
+        Packed legal moves for this turn. The list for the last
+        position asked about is kept, since checking and playing a
+        move and then starting the next turn all ask for it.
+        The list must not be changed.
+        '''
+        if self._legal[0] == self.hash:
+            return self._legal[1]
+        us = COLOUR_INDEX[self.turn]
+        legal = []
+        for move in self._pseudo_moves(us):
+            state = self._make(move)
+            if not self._in_check(us):
+                legal.append(move)
+            self._unmake(move, state)
+        self._legal = (self.hash, legal)
+        return legal
+
+    def _legal_by_key(self):
+        '''
+        This turn's legal moves by start | end << 6, as lists of
+        packed moves (a promotion has one per piece). Kept for the
+        last position asked about, like _legal_moves().
+        '''
+        if self._by_key[0] != self.hash:
+            by_key = {}
+            for move in self._legal_moves():
+                by_key.setdefault(move & 0xFFF, []).append(move)
+            self._by_key = (self.hash, by_key)
+        return self._by_key[1]
+
+    def is_legal(self, start, end):
+        '''Whether start -> end, (col,row) tuples, is legal this turn.'''
+        return to_square(start) | to_square(end) << 6 \
+            in self._legal_by_key()
+
+    def legal_targets(self):
+        '''
+        The squares each piece of the current player can move to,
+        as {start: [end, ...]} of (col,row) tuples.
+        '''
+        targets = {}
+        for key in self._legal_by_key():
+            targets.setdefault(to_coord(key & 63), []).append(
+                to_coord(key >> 6))
+        return targets
+
+    def legal_moves(self):
+        '''Generate a Move for every legal move for this turn.'''
+        for move in self._legal_moves():
+            yield Move(to_coord(move & 63), to_coord(move >> 6 & 63),
+                       self, promotion=PROMOTIONS.get(move >> 12))
+
+    def perft(self, depth):
+        '''Count the legal move paths that are `depth` plies long.'''
+        if depth == 0:
+            return 1
+        moves = self._legal_moves()
+        if depth == 1:
+            return len(moves)
+        nodes = 0
+        for move in moves:
+            state = self._make(move)
+            self._switch_turn()
+            nodes += self.perft(depth - 1)
+            self._switch_turn()
+            self._unmake(move, state)
+        return nodes
+
+    def divide(self, depth):
+        '''
+        perft() split by first move.
+
+        Returns:
+        dict of {move in long algebraic notation: path count}
+        '''
+        counts = {}
+        for move in self._legal_moves():
+            state = self._make(move)
+            self._switch_turn()
+            counts[uci(move)] = self.perft(depth - 1)
+            self._switch_turn()
+            self._unmake(move, state)
+        return counts
 
     @classmethod
     def promoteprompt(cls):
@@ -431,6 +1283,8 @@ class Board:
             self.info = self.info + f' captures {self.get_piece(end)}'
         elif kwargs.get('castling', False):
             self.info = self.info + f' (castling)'
+        elif kwargs.get('enpassant', False):
+            self.info = self.info + f' (en passant)'
         else:
             self.info = self.info + ''
     def start(self):
@@ -459,9 +1313,9 @@ class Board:
             self.add((x, 1), Pawn(colour))
         
         self.turn = 'white'
-
-        for piece in self.pieces():
-            piece.notmoved = True
+        self.castling = WHITE_KINGSIDE | WHITE_QUEENSIDE \
+            | BLACK_KINGSIDE | BLACK_QUEENSIDE
+        self.en_passant = None
 
     def display(self):
         '''
@@ -470,38 +1324,31 @@ class Board:
         First letter is the colour (W for white, B for black).
         Second letter is the name (Starting letter for each piece).
         '''
-        if self.debug:
-            print('== DEBUG MODE ON ==')
         # helper function to generate symbols for piece
 
         board = [[' ', "0", "1", "2", "3", "4", "5", "6", "7"]]
+        mailbox = self._mailbox
         # Row 7 is at the top, so print in reverse order
         for row in range(7, -1, -1):
-            rowlist = []
-            rowlist.append(str(row))
-            for col in range(8):
-                coord = (col, row)  # tuple
-                if coord in self.coords():
-                    piece = self.get_piece(coord)
-                    rowlist.append(f'{piece.get_img()}')
+            rowlist = [str(row)]
+            for piece in mailbox[row * 8:row * 8 + 8]:
+                if piece is not None:
+                    rowlist.append(piece.get_img())
                 else:
-                    piece = None
                     rowlist.append('None')
             board.append(rowlist)
-            if self.checkmate is not None:
-                print(f'{self.checkmate} is checkmated!')
         return board
 
     def prompt(self, move):
         if self.debug:
-            print('== PROMPT ==')
+            logger.debug('prompt(%r)', move)
         def valid_format(inputstr):
-            return len(inputstr) == 5 and inputstr[2] == ' ' \
-                and inputstr[0:1].isdigit() \
-                and inputstr[3:4].isdigit()
+            return isinstance(inputstr, str) \
+                and len(inputstr) == 5 and inputstr[2] == ' ' \
+                and (inputstr[0:2] + inputstr[3:5]).isdigit()
 
         def valid_num(inputstr):
-            for char in (inputstr[0:1] + inputstr[3:4]):
+            for char in (inputstr[0:2] + inputstr[3:5]):
                 if char not in '01234567':
                     return False
             return True
@@ -538,34 +1385,283 @@ class Board:
         start = move.start
         end = move.end
         if self.debug:
-            print('== UPDATE ==')
-        movetype = self.movetype(start, end)
-        if movetype is None:
-            raise MoveError(f'Invalid move ({self.printmove(start, end)})')
-        elif movetype == 'castling':
+            logger.debug('update(%s -> %s)', start, end)
+        code = self._find_move(start, end, move.promotion)
+        if code is None:
+            raise MoveError(f'Invalid move ({start} -> {end})')
+        movetype = self._classify(code)
+        if movetype == 'castling':
             self.printmove(start, end, castling=True)
-            self.castle(start, end)
+        elif movetype == 'enpassant':
+            self.printmove(start, end, enpassant=True)
         elif movetype == 'capture':
             self.printmove(start, end, capture=True)
-            self.remove(end)
-            self.move(start, end)
-            self.movehistory.push(move)
         elif movetype == 'move':
             self.printmove(start, end)
-            self.move(start, end)
-            self.movehistory.push(move)
         else:
             raise MoveError('Unknown error, please report '
                              f'(movetype={repr(movetype)}).')
+        self._play(code)
         if not self.alive('white', 'king'):
             self.winner = 'black'
         elif not self.alive('black', 'king'):
             self.winner = 'white'
 
+    def _switch_turn(self):
+        self._turn = 'black' if self._turn == 'white' else 'white'
+        self.hash ^= ZOBRIST_BLACK
+
     def next_turn(self):
+        '''
+        Go on to the next player's turn.
+        If that player has no legal moves, the game is over.
+        '''
         if self.debug:
-            print('== NEXT TURN ==')
-        if self.turn == 'white':
-            self.turn = 'black'
-        elif self.turn == 'black':
-            self.turn = 'white'
\ No newline at end of file
+            logger.debug('next turn')
+        self._switch_turn()
+        self.check_game_over()
+
+    def book_moves(self, book):
+        '''
+        The legal moves `book` (an OpeningBook) has for this
+        position, as a list of (packed move, weight).
+        '''
+        if book is None:
+            return []
+        legal = self._legal_moves()
+        return [(move, weight) for move, weight in book.moves(self.hash)
+                if move in legal]
+
+    def probe_tablebase(self, tablebase):
+        '''
+        Look this position up in `tablebase` (a Tablebase).
+
+        Returns:
+        ('win' | 'loss' | 'draw', plies to mate or None) for the
+        player to move, or None if the position is not covered
+        '''
+        if tablebase is None:
+            return None
+        return tablebase.probe(self)
+
+    def check_game_over(self):
+        '''Set the winner if the current player has no legal moves.'''
+        if not self._legal_moves():
+            if self.in_check(self.turn):
+                self.checkmate = self.turn
+                self.winner = COLOURS[1 - COLOUR_INDEX[self.turn]]
+            else:
+                self.winner = 'draw'
+
+
+# OpeningBook entry: key, packed move, weight, unused (Polyglot's "learn")
+BOOK_ENTRY = struct.Struct('>QHHI')
+BOOK_KEY = struct.Struct('>Q')
+
+# Bound stored with a TranspositionTable score
+EXACT = 0
+LOWER = 1  # the score is at least this (search failed high)
+UPPER = 2  # the score is at most this (search failed low)
+
+
+class TranspositionTable:
+    '''
+    Fixed-size cache of search results keyed by Board.hash,
+    for sharing between search and analysis code.
+
+    The table has `size` slots (rounded up to a power of two)
+    and a position can only live in the slot picked by the low
+    bits of its key. When two positions want the same slot, the
+    deeper search result is kept, except that results from an
+    earlier search (see new_search()) are always replaced.
+
+    ATTRIBUTES
+
+    hits, misses <int>
+        Lookups that found / did not find their position.
+
+    stores <int>
+        Results written into the table.
+
+    METHODS
+
+    get(key)
+        The (depth, score, bound, move) stored for `key`,
+        or None.
+
+    put(key, depth, score, bound, move)
+        Store a search result for `key`. `bound` is one of
+        EXACT, LOWER or UPPER.
+
+    new_search()
+        Mark the stored results as coming from an older search.
+    '''
+    def __init__(self, size=1 << 16):
+        if size < 1:
+            raise ValueError('size must be at least 1')
+        self.size = 1 << (size - 1).bit_length()
+        self._mask = self.size - 1
+        self.clear()
+
+    def __len__(self):
+        return self.size - self._keys.count(None)
+
+    def clear(self):
+        self._keys = [None] * self.size
+        self._entries = [None] * self.size
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+    def new_search(self):
+        self._generation += 1
+
+    def get(self, key):
+        slot = key & self._mask
+        if self._keys[slot] == key:
+            self.hits += 1
+            return self._entries[slot][:4]
+        self.misses += 1
+        return None
+
+    def put(self, key, depth, score, bound, move):
+        slot = key & self._mask
+        stored = self._entries[slot]
+        if stored is not None and self._keys[slot] != key \
+                and stored[4] == self._generation and stored[0] > depth:
+            return
+        self._keys[slot] = key
+        self._entries[slot] = (depth, score, bound, move, self._generation)
+        self.stores += 1
+
+
+class OpeningBook:
+    '''
+    Read-only opening book file. It has the layout of a Polyglot
+    book, 16-byte entries of (key, move, weight, learn) sorted by
+    key (see BOOK_ENTRY), but keys are Board.hash values and moves
+    are packed moves, so books are built with book.py rather than
+    taken from other programs.
+
+    The file is memory-mapped and searched in place, so opening
+    it reads nothing, and the pages of a large book are loaded
+    as they are needed and shared by every process using it.
+
+    METHODS
+
+    moves(key)
+        The (packed move, weight) entries for `key`.
+
+    close()
+        Unmap the file.
+    '''
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            size = f.seek(0, 2)
+            if size % BOOK_ENTRY.size:
+                raise ValueError(f'{path} is not an opening book')
+            # mmap cannot map an empty file
+            self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) \
+                if size else b''
+        self._count = size // BOOK_ENTRY.size
+
+    def __len__(self):
+        return self._count
+
+    def _key(self, index):
+        return BOOK_KEY.unpack_from(self._data, index * BOOK_ENTRY.size)[0]
+
+    def moves(self, key):
+        low, high = 0, self._count
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        found = []
+        for index in range(low, self._count):
+            entry_key, move, weight, _ = BOOK_ENTRY.unpack_from(
+                self._data, index * BOOK_ENTRY.size)
+            if entry_key != key:
+                break
+            found.append((move, weight))
+        return found
+
+    def close(self):
+        if self._data:
+            self._data.close()
+
+
+# Endings covered by tablebases: the piece added to the two kings
+TABLEBASE_PIECES = {'KQK': Queen, 'KRK': Rook, 'KPK': Pawn}
+TABLEBASE_SIZE = 2 * 64 * 64 * 64
+
+
+def tablebase_index(turn, king, other_king, sq):
+    '''
+    Index of a position in a tablebase file, with the side that
+    has the extra piece playing white: `turn` is 0 if that side
+    is to move, else 1.
+    '''
+    return ((turn * 64 + king) * 64 + other_king) * 64 + sq
+
+
+class Tablebase:
+    '''
+    Exact results for the endings in TABLEBASE_PIECES, read from
+    the <name>.tb files made by tablebase.py in `directory`.
+
+    Each file holds one byte per tablebase_index(): 0 for a draw
+    (or an impossible position), otherwise 1 + the plies to mate,
+    which is odd if the player to move wins and even if they
+    lose. Files are memory-mapped, so a probe is one byte read.
+
+    METHODS
+
+    probe(board)
+        See Board.probe_tablebase().
+    '''
+    def __init__(self, directory):
+        self._tables = {}
+        for name, cls in TABLEBASE_PIECES.items():
+            try:
+                f = open(os.path.join(directory, name + '.tb'), 'rb')
+            except FileNotFoundError:
+                continue
+            with f:
+                if f.seek(0, 2) != TABLEBASE_SIZE:
+                    raise ValueError(f'{f.name} is not a tablebase')
+                self._tables[cls.kind] = mmap.mmap(
+                    f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __contains__(self, name):
+        return TABLEBASE_PIECES[name].kind in self._tables
+
+    def probe(self, board):
+        occupied = board._occupancy[0] | board._occupancy[1]
+        if bin(occupied).count('1') != 3 or board.castling:
+            return None
+        bitboards = board._bitboards
+        for kind, table in self._tables.items():
+            for strong in (0, 1):
+                pieces = bitboards[strong * 6 + kind]
+                if pieces:
+                    break
+            else:
+                continue
+            king = bitboards[strong * 6 + King.kind].bit_length() - 1
+            other_king = bitboards[(1 - strong) * 6 + King.kind] \
+                .bit_length() - 1
+            sq = pieces.bit_length() - 1
+            if strong:
+                # Mirror the board so the strong side plays white
+                king, other_king, sq = king ^ 56, other_king ^ 56, sq ^ 56
+            turn = COLOUR_INDEX[board.turn] ^ strong
+            value = table[tablebase_index(turn, king, other_king, sq)]
+            if value == 0:
+                return 'draw', None
+            plies = value - 1
+            return ('win' if plies % 2 else 'loss'), plies
+        return None
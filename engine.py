@@ -0,0 +1,406 @@
+'''
+Computer opponent: iterative-deepening alpha-beta search.
+
+think() is the entry point used by the web app. It runs in a
+worker process (see main.py), so a long search never holds up
+the Flask threads serving other players. While the position is
+in the opening book it plays a book move instead of searching,
+and in an ending covered by the tablebases it plays the move
+they say is best (see init_worker()).
+
+While a human player thinks, Ponder has the engine's replies to
+their likeliest moves worked out in advance.
+'''
+import os
+import random
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+from chess import (Pawn, PROMOTIONS, EN_PASSANT, PIECE_VALUES,
+                   OpeningBook, Tablebase, TranspositionTable,
+                   EXACT, LOWER, UPPER)
+
+
+MATE = 100000
+INFINITY = MATE + 1
+
+# Shared by every search run in this process
+table = TranspositionTable(1 << 18)
+book = None
+tablebase = None
+
+
+def init_worker(book_path=None, tablebase_dir=None):
+    '''
+    Use the opening book file and the tablebase directory given,
+    if they exist.
+    '''
+    global book, tablebase
+    if book_path is not None and os.path.exists(book_path):
+        book = OpeningBook(book_path)
+    if tablebase_dir is not None and os.path.isdir(tablebase_dir):
+        tablebase = Tablebase(tablebase_dir)
+
+
+class SearchTimeout(Exception):
+    '''Raised inside a search when its time budget runs out.'''
+    pass
+
+
+def evaluate(board):
+    '''Board.evaluate() from the side to move's view.'''
+    score = board.evaluate()
+    return score if board.turn == 'white' else -score
+
+
+class Search:
+    '''
+    One search of `board` with a hard deadline.
+
+    The board is changed while searching and restored before
+    run() returns.
+
+    ATTRIBUTES
+
+    nodes <int>
+        Positions visited so far.
+
+    depth <int>
+        Deepest fully searched iteration.
+    '''
+    check_every = 1024  # nodes between deadline checks
+
+    def __init__(self, board, time_limit, table=table):
+        self.board = board
+        self.table = table
+        self.deadline = time.perf_counter() + time_limit
+        self.nodes = 0
+        self.depth = 0
+        self.killers = {}
+        self._root_move = None
+
+    def run(self, max_depth=64):
+        '''
+        Search deeper and deeper until time runs out or
+        `max_depth` is reached.
+
+        Returns:
+        (best packed move, score in centipawns)
+        Best move is None if there are no legal moves.
+        '''
+        self.table.new_search()
+        best, score = None, 0
+        for depth in range(1, max_depth + 1):
+            try:
+                score = self.negamax(depth, -INFINITY, INFINITY, 0)
+            except SearchTimeout:
+                break
+            best = self._root_move
+            self.depth = depth
+            if abs(score) >= MATE - max_depth:
+                break
+        if best is None:
+            moves = self.board._legal_moves()
+            best = moves[0] if moves else None
+        return best, score
+
+    def _tick(self):
+        self.nodes += 1
+        if self.nodes % self.check_every == 0 \
+                and time.perf_counter() > self.deadline:
+            raise SearchTimeout()
+
+    def ordered(self, moves, best, ply):
+        '''
+        Sort moves: stored best move first, then captures by
+        most valuable victim / least valuable attacker, then
+        promotions and killer moves.
+        '''
+        mailbox = self.board._mailbox
+        killers = self.killers.get(ply, ())
+
+        def key(move):
+            if move == best:
+                return -1000000
+            victim = mailbox[move >> 6 & 63]
+            flag = move >> 12
+            if victim is not None:
+                return -100 * PIECE_VALUES[victim.kind] \
+                    + PIECE_VALUES[mailbox[move & 63].kind] // 100
+            if flag == EN_PASSANT:
+                return -100 * PIECE_VALUES[Pawn.kind]
+            if flag in PROMOTIONS:
+                return -PIECE_VALUES[PROMOTIONS[flag].kind]
+            if move in killers:
+                return 0
+            return 1
+        return sorted(moves, key=key)
+
+    def _play(self, move):
+        '''
+        Play a pseudo-legal move and pass the turn.
+
+        Returns:
+        state for _unplay()
+        or None (and the board unchanged) if the move is illegal
+        '''
+        board = self.board
+        us = 0 if board.turn == 'white' else 1
+        state = board._make(move)
+        if board._in_check(us):
+            board._unmake(move, state)
+            return None
+        board._switch_turn()
+        return state
+
+    def _unplay(self, move, state):
+        self.board._switch_turn()
+        self.board._unmake(move, state)
+
+    def _in_check(self):
+        board = self.board
+        return board._in_check(0 if board.turn == 'white' else 1)
+
+    def negamax(self, depth, alpha, beta, ply):
+        self._tick()
+        board = self.board
+        if depth <= 0:
+            return self.quiesce(alpha, beta)
+
+        key = board.hash
+        entry = self.table.get(key)
+        best_move = None
+        if entry is not None:
+            stored_depth, score, bound, best_move = entry
+            if stored_depth >= depth and ply > 0:
+                if bound == EXACT \
+                        or bound == LOWER and score >= beta \
+                        or bound == UPPER and score <= alpha:
+                    return score
+
+        us = 0 if board.turn == 'white' else 1
+        moves = self.ordered(board._pseudo_moves(us), best_move, ply)
+        original_alpha = alpha
+        best_score = -INFINITY
+        best_move = None
+        for move in moves:
+            state = self._play(move)
+            if state is None:
+                continue
+            try:
+                score = -self.negamax(depth - 1, -beta, -alpha, ply + 1)
+            finally:
+                self._unplay(move, state)
+            if score > best_score:
+                best_score, best_move = score, move
+                if ply == 0:
+                    self._root_move = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                if board._mailbox[move >> 6 & 63] is None:
+                    killers = self.killers.setdefault(ply, [])
+                    if move not in killers:
+                        killers.insert(0, move)
+                        del killers[2:]
+                break
+
+        if best_move is None:
+            # No legal moves: checkmate or stalemate
+            return -MATE + ply if self._in_check() else 0
+
+        if best_score <= original_alpha:
+            bound = UPPER
+        elif best_score >= beta:
+            bound = LOWER
+        else:
+            bound = EXACT
+        self.table.put(key, depth, best_score, bound, best_move)
+        return best_score
+
+    def quiesce(self, alpha, beta):
+        '''Search captures only, so the evaluation is taken in a quiet position.'''
+        self._tick()
+        board = self.board
+        stand_pat = evaluate(board)
+        if stand_pat >= beta:
+            return stand_pat
+        if stand_pat > alpha:
+            alpha = stand_pat
+        us = 0 if board.turn == 'white' else 1
+        mailbox = board._mailbox
+        captures = [move for move in board._pseudo_moves(us)
+                    if mailbox[move >> 6 & 63] is not None
+                    or move >> 12 == EN_PASSANT
+                    or move >> 12 in PROMOTIONS]
+        for move in self.ordered(captures, None, None):
+            state = self._play(move)
+            if state is None:
+                continue
+            try:
+                score = -self.quiesce(-beta, -alpha)
+            finally:
+                self._unplay(move, state)
+            if score >= beta:
+                return score
+            if score > alpha:
+                alpha = score
+        return alpha
+
+
+def tablebase_move(board):
+    '''
+    The move the tablebase rates best: the quickest win, else a
+    draw, else the slowest loss. None if the position is not in
+    the tablebase.
+    '''
+    if board.probe_tablebase(tablebase) is None:
+        return None
+    best, best_rank = None, None
+    for move in board._legal_moves():
+        state = board._make(move)
+        board._switch_turn()
+        # Leaving the ending (a capture, say) can only draw
+        result, plies = board.probe_tablebase(tablebase) or ('draw', None)
+        board._switch_turn()
+        board._unmake(move, state)
+        # The result is the opponent's
+        if result == 'loss':
+            rank = (2, -plies)
+        elif result == 'draw':
+            rank = (1, 0)
+        else:
+            rank = (0, plies)
+        if best_rank is None or rank > best_rank:
+            best, best_rank = move, rank
+    return best
+
+
+def think(board, ms):
+    '''
+    Choose a move for `board.turn` within `ms` milliseconds.
+
+    Returns:
+    packed move int, or None if there are no legal moves
+    '''
+    choices = board.book_moves(book)
+    if choices:
+        moves, weights = zip(*choices)
+        return random.choices(moves, weights)[0]
+    move = tablebase_move(board)
+    if move is not None:
+        return move
+    move, score = Search(board, ms / 1000).run()
+    return move
+
+
+def likely_moves(board, count, ms):
+    '''
+    The `count` moves the player to move is likeliest to choose:
+    book moves by weight, else the moves that score best in a
+    two-ply search, taking at most `ms` milliseconds.
+
+    Returns:
+    list of packed moves, likeliest first
+    '''
+    choices = board.book_moves(book)
+    if choices:
+        choices.sort(key=lambda choice: -choice[1])
+        return [move for move, weight in choices[:count]]
+    search = Search(board, ms / 1000)
+    moves = search.ordered(board._legal_moves(), None, None)
+    scores = {}
+    try:
+        for move in moves:
+            state = search._play(move)
+            try:
+                scores[move] = -search.negamax(1, -INFINITY, INFINITY, 1)
+            finally:
+                search._unplay(move, state)
+    except SearchTimeout:
+        pass
+    # Moves not scored in time keep their order, after the others
+    moves.sort(key=lambda move: -scores.get(move, -INFINITY))
+    return moves[:count]
+
+
+class Ponder:
+    '''
+    The engine's replies to the likeliest moves of a human player,
+    worked out in `pool` while they think. Made by the web app
+    after the engine moves: one job ranks the human's moves with
+    likely_moves(), then think() runs once for each of the first
+    `count`.
+
+    The replies are kept by the hash of the position each human
+    move leads to, so a reply is only ever found for the position
+    it was worked out for, however the game got there.
+
+    METHODS
+
+    reply(board)
+        The engine's move for `board`, if it was pondered.
+
+    cancel()
+        Drop any work not yet started.
+    '''
+    def __init__(self, pool, board, ms, count):
+        self.pool = pool
+        self.board = board
+        self.ms = ms
+        self.replies = {}  # position hash: Future of think()
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._ranking = pool.submit(likely_moves, board, count, ms)
+        self._ranking.add_done_callback(self._ranked)
+
+    def _ranked(self, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        with self._lock:
+            for move in future.result():
+                if self.cancelled:
+                    return
+                board = self.board.copy()
+                board._play(move)
+                board._switch_turn()
+                try:
+                    self.replies[board.hash] = self.pool.submit(
+                        think, board, self.ms)
+                except (RuntimeError, BrokenProcessPool):
+                    # The pool was shut down; nothing left to ponder
+                    self._cancel()
+                    return
+
+    def reply(self, board):
+        '''
+        Look up the reply for `board`, the position after the
+        human's move, and cancel the rest. A reply still being
+        searched is waited for, as it is further along than a new
+        search would be.
+
+        Returns:
+        packed move int, or None if it was not pondered
+        '''
+        with self._lock:
+            future = self.replies.pop(board.hash, None)
+            self._cancel()
+        if future is None or future.cancel():
+            return None
+        try:
+            return future.result()
+        except Exception:
+            # Whatever went wrong, searching afresh is still fine
+            return None
+
+    def cancel(self):
+        with self._lock:
+            self._cancel()
+
+    def _cancel(self):
+        self.cancelled = True
+        self._ranking.cancel()
+        for future in self.replies.values():
+            future.cancel()
+        self.replies.clear()
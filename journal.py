@@ -0,0 +1,314 @@
+'''
+Append-only journal of every game, so that games in progress
+survive a restart or a crashed worker.
+
+Each game has its own file, <directory>/<game_id>.journal, made
+of fixed-size records:
+
+    START    engine colour, engine thinking time in ms
+    SETUP    length of a FEN string, followed by the string padded
+             to a whole number of records; for games that do not
+             start from the usual position
+    MOVE     packed move, as played by Board.update()
+    PROMOTE  kind of the piece a waiting pawn became
+    UNDO     one move taken back
+
+Request threads only append records to a buffer in memory. A
+background thread writes the buffers out and fsyncs every file
+it touched once per `interval`, so a burst of moves costs one
+disk sync instead of one per move. A crash loses at most the
+last `interval` seconds of moves.
+
+If a journal cannot be written (the disk is full, say), its
+records are kept in memory and the writer tries again every
+`interval` until it succeeds.
+'''
+import logging
+import os
+import re
+import struct
+import threading
+import time
+
+from chess import PIECE_CLASSES
+
+
+logger = logging.getLogger(__name__)
+
+START = 1
+MOVE = 2
+PROMOTE = 3
+UNDO = 4
+SETUP = 5
+
+RECORD = struct.Struct('<BBH')  # kind, small argument, 16-bit value
+SUFFIX = '.journal'
+GAME_ID = re.compile(r'[A-Za-z0-9_-]+')
+
+# Engine colour in a START record
+ENGINE_COLOURS = (None, 'white', 'black')
+
+
+class GameJournal:
+    '''
+    Buffers journal records and writes them out in batches.
+
+    METHODS
+
+    start()
+        Start the background writer.
+
+    new(game_id, engine, engine_ms, fen), move(game_id, code),
+    promote(game_id, kind), undo(game_id)
+        Append a record to `game_id`'s journal.
+
+    remove(game_id)
+        Delete `game_id`'s journal.
+
+    flush()
+        Write out and fsync everything buffered so far; see the
+        method for errors.
+
+    load()
+        Yield (game_id, records) for every journal on disk.
+    '''
+    def __init__(self, directory, interval=0.05):
+        self.directory = directory
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Held while writing, so flush() and the writer take turns
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, game_id):
+        if not GAME_ID.fullmatch(game_id):
+            raise ValueError(f'Invalid game id {game_id!r}')
+        return os.path.join(self.directory, game_id + SUFFIX)
+
+    def start(self):
+        threading.Thread(target=self._run, name='game-journal',
+                         daemon=True).start()
+
+    def _append(self, game_id, kind, arg=0, value=0, data=b''):
+        record = RECORD.pack(kind, arg, value) + data
+        with self._lock:
+            buffer = self._pending.get(game_id)
+            if buffer is None:
+                buffer = self._pending[game_id] = bytearray()
+            buffer += record
+        self._wake.set()
+
+    def new(self, game_id, engine=None, engine_ms=0, fen=None):
+        self._append(game_id, START, ENGINE_COLOURS.index(engine),
+                     min(engine_ms or 0, 0xFFFF))
+        if fen is not None:
+            data = fen.encode('ascii')
+            padding = -len(data) % RECORD.size
+            self._append(game_id, SETUP, 0, len(data),
+                         data + b' ' * padding)
+
+    def move(self, game_id, code):
+        self._append(game_id, MOVE, 0, code & 0xFFFF)
+
+    def promote(self, game_id, kind):
+        self._append(game_id, PROMOTE, kind)
+
+    def undo(self, game_id):
+        self._append(game_id, UNDO)
+
+    def remove(self, game_id):
+        with self._write_lock:
+            with self._lock:
+                self._pending.pop(game_id, None)
+            try:
+                os.remove(self.path(game_id))
+            except FileNotFoundError:
+                pass
+
+    def flush(self):
+        '''
+        Raises:
+        OSError if a journal could not be written or synced. The
+        records that could not be written stay buffered for the
+        next flush(); those written but not synced are not
+        written again, which would duplicate them.
+        '''
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            failed = {}
+            error = None
+            fds = []
+            try:
+                for game_id, records in pending.items():
+                    try:
+                        fds.append(self._write(game_id, records))
+                    except OSError as e:
+                        failed[game_id] = records
+                        error = e
+                for fd in fds:
+                    try:
+                        os.fsync(fd)
+                    except OSError as e:
+                        error = e
+            finally:
+                for fd in fds:
+                    os.close(fd)
+                if failed:
+                    with self._lock:
+                        for game_id, records in failed.items():
+                            self._pending[game_id] = \
+                                records + self._pending.get(game_id, b'')
+            if error is not None:
+                raise error
+
+    def _write(self, game_id, records):
+        '''
+        Append `records` to `game_id`'s journal, all or nothing.
+
+        Returns:
+        the open file descriptor, to be synced and closed
+        '''
+        fd = os.open(self.path(game_id), os.O_WRONLY | os.O_APPEND
+                     | os.O_CREAT, 0o644)
+        size = os.fstat(fd).st_size
+        try:
+            view = memoryview(records)
+            while view:
+                view = view[os.write(fd, view):]
+        except OSError:
+            # Cut off any part that got written, so that the
+            # records can be written whole next time
+            try:
+                os.ftruncate(fd, size)
+            finally:
+                os.close(fd)
+            raise
+        return fd
+
+    def _run(self):
+        failing = False
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            try:
+                self.flush()
+            except OSError:
+                if not failing:
+                    logger.exception('Cannot write the game journal; '
+                                     'retrying every %gs', self.interval)
+                failing = True
+                # Retry even if no more records come in
+                self._wake.set()
+            else:
+                if failing:
+                    logger.warning('The game journal is being written again')
+                failing = False
+            # Let the next records gather into one batch
+            time.sleep(self.interval)
+
+    def load(self):
+        for name in os.listdir(self.directory):
+            game_id, suffix = os.path.splitext(name)
+            if suffix != SUFFIX or not GAME_ID.fullmatch(game_id):
+                continue
+            with open(os.path.join(self.directory, name), 'rb') as f:
+                data = f.read()
+            records = read_records(data)
+            if records and records[0][0] == START:
+                yield game_id, records
+
+
+class NullJournal:
+    '''
+    Stands in for a GameJournal when games are kept somewhere
+    durable already (see store.SQLiteGameStore); records nothing.
+    '''
+    def start(self):
+        pass
+
+    def new(self, game_id, engine=None, engine_ms=0, fen=None):
+        pass
+
+    def move(self, game_id, code):
+        pass
+
+    def promote(self, game_id, kind):
+        pass
+
+    def undo(self, game_id):
+        pass
+
+    def remove(self, game_id):
+        pass
+
+    def flush(self):
+        pass
+
+    def load(self):
+        return iter(())
+
+
+def read_records(data):
+    '''
+    Unpack a journal into (kind, arg, value) tuples; for SETUP
+    records the value is the FEN string. A record cut short by a
+    crash is dropped.
+    '''
+    records = []
+    size = RECORD.size
+    pos = 0
+    while pos + size <= len(data):
+        record = RECORD.unpack_from(data, pos)
+        pos += size
+        if record[0] == SETUP:
+            length = record[2]
+            padded = length + -length % size
+            if pos + padded > len(data):
+                break
+            record = (SETUP, 0, data[pos:pos + length].decode('ascii'))
+            pos += padded
+        records.append(record)
+    return records
+
+
+def game_settings(records):
+    '''
+    The (engine colour, engine ms, FEN or None) a journal's game
+    was started with.
+    '''
+    _, colour, ms = records[0]
+    fen = None
+    if len(records) > 1 and records[1][0] == SETUP:
+        fen = records[1][2]
+    return ENGINE_COLOURS[colour], ms or None, fen
+
+
+def replay(board, records):
+    '''
+    Play a journal's records on `board`, which must be set up
+    as game_settings() says. Moves are made directly on the board,
+    without the checks done for a move typed in by a player.
+    '''
+    history = board.movehistory
+    waiting = False  # a pawn is waiting to be promoted
+    for kind, arg, value in records:
+        if kind == MOVE:
+            board._play(value)
+            waiting = bool(board.promotepawns())
+            if not waiting:
+                board._switch_turn()
+        elif kind == PROMOTE:
+            board.promotepawns(PIECE_CLASSES[arg])
+            board._switch_turn()
+            waiting = False
+        elif kind == UNDO:
+            board.undo(history.pop())
+            # Undoing a pawn still waiting to promote keeps the turn
+            if not waiting:
+                board._switch_turn()
+            waiting = False
+    if not waiting:
+        board.check_game_over()
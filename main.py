@@ -1,102 +1,829 @@
-from flask import Flask, render_template, redirect, request
+import functools
+import hashlib
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import Blueprint, Flask, render_template, redirect, request, jsonify
+from flask import abort, current_app, g, make_response, url_for
+from markupsafe import Markup
 # from werkzeug.wrappers import Request
 from chess import *
+import engine
+import metrics
+from journal import GameJournal, NullJournal, game_settings, replay
+from store import GameStore, LRUCache, SQLiteGameStore
+from stream import EventChannel, EventRelay
+try:
+    import analysis
+except ImportError:  # NumPy is not installed
+    analysis = None
 
 
-app = Flask(__name__)
-# ui = WebInterface()
-# game = Board(debug=False)
+bp = Blueprint('chess', __name__)
 
-@app.route('/')
-def root():
-    return render_template('index.html')
+def create_app(**config):
+    '''
+    Make the app, with `config` overriding the defaults below, and
+    set up the games, caches and engine pool its requests use (see
+    AppState). Each app has its own; call
+    app.extensions['chess'].close() when done with one.
 
-@app.route('/newgame')
-def newgame():
-    # Note that in Python, objects and variables
-    # in the global space are available to
-    # top-level functions
-    global ui
-    ui = WebInterface()
-    global game
-    game = Board(debug=False)
-    game.start()
+    With GAME_STORE='memory' games live in this process and are
+    journaled to JOURNAL_DIR, and the games in progress there are
+    recovered. With 'sqlite' they live in the GAME_DB file, which
+    every process serving the app on this host can share (see
+    serve.py).
+    '''
+    app = Flask(__name__)
+    app.config.from_mapping(
+        GAME_STORE='memory',  # 'memory' or 'sqlite', see above
+        GAME_DB=os.path.join(app.instance_path, 'games.sqlite3'),
+        MAX_GAMES=10000,   # games kept before the oldest is evicted
+        GAME_TTL=60 * 60,  # seconds a game may sit idle before it is evicted
+        STREAM_PORT=5001,  # port of the server-sent events channel
+        # if set, the channel runs in another process and events are
+        # relayed to it on this UDP port
+        STREAM_RELAY_PORT=None,
+        ENGINE_WORKERS=None,  # engine processes (None: one per CPU)
+        ENGINE_MS=1000,    # default engine thinking time per move
+        ENGINE_MAX_MS=10000,
+        # human moves the engine prepares replies to while they think
+        # (0: don't ponder); with several app processes a reply is
+        # only found by the one that pondered it
+        PONDER_MOVES=4,
+        PONDER_WORKERS=1,  # processes pondering, apart from the engine's
+        # opening book for the engine, used if the file exists
+        BOOK_PATH=os.path.join(app.instance_path, 'book.bin'),
+        # endgame tablebases from tablebase.py, used if present
+        TABLEBASE_DIR=os.path.join(app.instance_path, 'tablebases'),
+        RENDER_CACHE_SIZE=4096,  # rendered boards kept for reuse
+        POSITION_CACHE_SIZE=4096,  # parsed FEN positions kept for reuse
+        STATIC_MAX_AGE=365 * 24 * 60 * 60,  # for versioned static files
+        # memory games are journaled here and recovered on startup
+        JOURNAL_DIR=os.path.join(app.instance_path, 'journal'),
+        JOURNAL_INTERVAL=0.05,  # seconds between journal disk syncs
+        ANALYSE_MAX_PLIES=2000,  # longest move list /analyse accepts
+    )
+    app.config.from_mapping(config)
+    app.register_blueprint(bp)
+
+    shared = app.extensions['chess'] = AppState(app.config)
+    # Recovery sets boards up as requests do, through state()
+    with app.app_context():
+        recover_games(shared)
+    shared.journal.start()
+    return app
+
+
+class AppState:
+    '''
+    What one app's requests share, made from its config by
+    create_app() and kept in app.extensions['chess'] (see state()).
+
+    ATTRIBUTES
+
+    journal <GameJournal or NullJournal>
+    games <GameStore or SQLiteGameStore>
+    channel <EventChannel or EventRelay>
+
+    board_cache <LRUCache>
+        Rendered board tables by (Board.hash, orientation);
+        positions such as the starting one are shared between all
+        games.
+
+    position_cache <LRUCache>
+        Boards parsed from FEN strings, which new games copy.
+
+    engine_pool <ProcessPoolExecutor>
+        Where the engine searches, so that it never holds the GIL
+        while Flask threads serve other players.
+
+    ponder_pool <ProcessPoolExecutor or None>
+        Where searches run ahead of time while players think (see
+        engine.Ponder); None if pondering is off.
+
+    pondering <LRUCache>
+        engine.Ponder for each game being pondered, by game id.
+
+    METHODS
+
+    close()
+        Shut down the engine processes and write out the journal.
+    '''
+    def __init__(self, config):
+        if config['GAME_STORE'] == 'memory':
+            self.journal = GameJournal(config['JOURNAL_DIR'],
+                                       interval=config['JOURNAL_INTERVAL'])
+            self.games = GameStore(max_games=config['MAX_GAMES'],
+                                   ttl=config['GAME_TTL'],
+                                   journal=self.journal)
+        elif config['GAME_STORE'] == 'sqlite':
+            self.journal = NullJournal()
+            self.games = SQLiteGameStore(config['GAME_DB'],
+                                         max_games=config['MAX_GAMES'],
+                                         ttl=config['GAME_TTL'])
+        else:
+            raise ValueError(f"Unknown GAME_STORE {config['GAME_STORE']!r}")
+        if config['STREAM_RELAY_PORT'] is None:
+            self.channel = EventChannel()
+        else:
+            self.channel = EventRelay(config['STREAM_RELAY_PORT'])
+        self.board_cache = LRUCache(config['RENDER_CACHE_SIZE'])
+        self.position_cache = LRUCache(config['POSITION_CACHE_SIZE'])
+        # Each worker maps the opening book and tablebases; the
+        # pages are shared.
+        self.engine_pool = engine_processes(config, config['ENGINE_WORKERS'])
+        # Pondering has processes of its own, so that moves players
+        # are waiting for never queue behind it
+        self.ponder_pool = None
+        if config['PONDER_MOVES'] > 0:
+            self.ponder_pool = engine_processes(config,
+                                                config['PONDER_WORKERS'])
+        self.pondering = LRUCache(config['MAX_GAMES'])
+
+    def close(self):
+        # Their processes would outlive this one otherwise
+        self.engine_pool.shutdown(cancel_futures=True)
+        if self.ponder_pool is not None:
+            self.ponder_pool.shutdown(cancel_futures=True)
+        self.journal.flush()
+
+
+def state():
+    '''The AppState of the app handling the current request.'''
+    return current_app.extensions['chess']
+
+
+def engine_processes(config, workers):
+    '''
+    A pool of `workers` engine processes for an app's `config`. Workers are
+    started when first needed, which is usually from a request
+    thread; forking then could copy locks other threads hold into
+    the child, so they come from a forkserver (or are spawned,
+    where there is none) instead.
+    '''
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+    else:
+        context = multiprocessing.get_context('spawn')
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=context,
+        initializer=engine.init_worker,
+        initargs=(config['BOOK_PATH'], config['TABLEBASE_DIR']))
+
+
+PROMOTION_CHOICES = {'Rook': Rook, 'Knight': Knight,
+                     'Bishop': Bishop, 'Queen': Queen}
+
+REQUEST_SECONDS = metrics.Histogram(
+    'chess_request_seconds', 'Time taken to answer a request, by route.',
+    label='route')
+ENGINE_SECONDS = metrics.Histogram(
+    'chess_engine_seconds', 'Time the engine took to choose a move.')
+MOVES = metrics.Counter(
+    'chess_moves_total', 'Moves played, by human or engine.', label='player')
+INVALID_MOVES = metrics.Counter(
+    'chess_invalid_moves_total', 'Moves rejected as invalid.')
+UNDOS = metrics.Counter('chess_undos_total', 'Moves taken back.')
+LEGAL_MOVES_SECONDS = metrics.Histogram(
+    'chess_legal_moves_seconds',
+    'Time spent checking moves against, or listing, the legal moves.')
+UPDATE_SECONDS = metrics.Histogram(
+    'chess_board_update_seconds', 'Time spent in Board.update().')
+PONDERED = metrics.Counter(
+    'chess_pondered_moves_total',
+    'Human moves played while the engine pondered, by whether it had '
+    'a reply ready (hit) or had to search (miss).', label='result')
+GAMES_STARTED = metrics.Counter(
+    'chess_games_started_total', 'Games started.')
+metrics.Gauge('chess_games_live', 'Games in progress.',
+              lambda: len(state().games))
+metrics.Gauge('chess_event_streams', 'Open event streams.',
+              lambda: state().channel.connections())
+metrics.FunctionCounter(
+    'chess_board_cache_hits_total', 'Rendered boards reused.',
+    lambda: state().board_cache.hits)
+metrics.FunctionCounter(
+    'chess_board_cache_misses_total', 'Boards rendered.',
+    lambda: state().board_cache.misses)
+metrics.FunctionCounter(
+    'chess_position_cache_hits_total', 'FEN positions reused.',
+    lambda: state().position_cache.hits)
+metrics.FunctionCounter(
+    'chess_position_cache_misses_total', 'FEN positions parsed.',
+    lambda: state().position_cache.misses)
+
+
+_static_versions = {}
+
+
+def static_version(filename):
+    '''
+    Hash of a static file's contents, worked out again only when
+    the file changes.
+    '''
+    path = os.path.join(current_app.static_folder, filename)
+    mtime = os.stat(path).st_mtime_ns
+    cached = _static_versions.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            version = hashlib.sha1(f.read()).hexdigest()[:12]
+        cached = _static_versions[filename] = (mtime, version)
+    return cached[1]
+
+
+@bp.app_template_global()
+def static_url(filename):
+    '''
+    URL of a static file with a hash of its contents appended,
+    so it can be cached for good and still change on deploy.
+    '''
+    return url_for('static', filename=filename, v=static_version(filename))
+
+
+@bp.before_app_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+
+@bp.after_app_request
+def record_time(response):
+    '''Add the request's time to its route's latency histogram.'''
+    if request.url_rule is not None and 'request_started' in g:
+        REQUEST_SECONDS.labels(request.url_rule.rule).observe(
+            time.perf_counter() - g.request_started)
+    return response
+
+
+@bp.after_app_request
+def cache_static(response):
+    '''
+    Let browsers keep versioned static files without revalidating.
+    A version other than the file's current one (an old or made-up
+    URL) keeps the usual revalidating headers, or that URL would
+    stay cached with whatever it served first.
+    '''
+    if request.endpoint == 'static' and response.status_code == 200 \
+            and request.args.get('v') == static_version(
+                request.view_args['filename']):
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = \
+            current_app.config['STATIC_MAX_AGE']
+        response.cache_control.immutable = True
+    return response
+
+
+def with_game(view):
+    '''
+    Check out the player's game from the game_id cookie and call
+    view(game, ui) while holding it.
+    '''
+    @functools.wraps(view)
+    def wrapper():
+        with state().games.checkout(request.cookies.get('game_id')) \
+                as session:
+            if session is None:
+                return redirect('/newgame')
+            return view(session.board, session.ui)
+    return wrapper
+
+
+def show_board(game, ui):
+    '''Refresh the board and evaluation shown for `game`.'''
     ui.board = game.display()
+    ui.score = game.evaluate()
+    # Share of the eval bar filled in for white, in percent
+    ui.eval_bar = round(50 + 50 * math.tanh(ui.score / 600), 1)
+
+
+def play_move(game, ui, move):
+    '''
+    Validate and carry out `move` (e.g. '41 43') for the current
+    player, keeping `ui` up to date.
+
+    Returns:
+    'winner' if the game is over
+    'promote' if a pawn is waiting to be promoted
+    None otherwise (ui.errmsg is set if the move was invalid)
+    '''
+    with LEGAL_MOVES_SECONDS.time():
+        valid, output = game.prompt(move)
+    if not valid:
+        INVALID_MOVES.inc()
+        ui.errmsg = output
+        return None
+    ui.errmsg = None
+    with UPDATE_SECONDS.time():
+        game.update(output)
+    MOVES.labels('human').inc()
+    state().journal.move(ui.game_id, game.movehistory[-1])
+    ui.empty = game.movehistory.empty()
+    ui.info = game.info
+    show_board(game, ui)
+    if game.winner is not None:
+        return 'winner'
+    if game.promotepawns():
+        return 'promote'
+    return finish_turn(game, ui)
+
+
+def promote_pawn(game, ui, piece):
+    '''Promote the waiting pawn to `piece`, e.g. 'Queen'.'''
+    if not game.promotepawns():
+        ui.errmsg = 'There is no pawn to promote.'
+        return None
+    PieceClass = PROMOTION_CHOICES.get(piece)
+    if PieceClass is None:
+        ui.errmsg = f'Cannot promote to {piece}.'
+        return 'promote'
+    ui.errmsg = None
+    game.promotepawns(PieceClass)
+    state().journal.promote(ui.game_id, PieceClass.kind)
+    show_board(game, ui)
+    ui.info = game.info
+    return finish_turn(game, ui)
+
+
+def undo_move(game, ui):
+    '''Take back the last move.'''
+    if game.movehistory.empty():
+        ui.errmsg = 'There is no move to undo.'
+        return None
+    # A pawn waiting to be promoted hasn't finished its turn yet
+    finished = not game.promotepawns()
+    if finished and ui.engine is not None and game.turn != ui.engine \
+            and len(game.movehistory) == 1:
+        # Only the engine's opening move of a /position game is left
+        ui.errmsg = 'There is no move of yours to undo.'
+        return None
+    ui.errmsg = None
+    stop_pondering(ui)
+    journal = state().journal
+    game.undo(game.movehistory.pop())
+    journal.undo(ui.game_id)
+    UNDOS.inc()
+    if finished:
+        game.next_turn()
+    # Against the engine, take back its reply as well
+    while game.turn == ui.engine and not game.movehistory.empty():
+        game.undo(game.movehistory.pop())
+        journal.undo(ui.game_id)
+        UNDOS.inc()
+        game.next_turn()
+    ui.turn = game.turn
+    ui.empty = game.movehistory.empty()
+    show_board(game, ui)
+    ui.info = f"undo {game.info}"
+    start_pondering(game, ui)
+    return None
+
+
+def finish_turn(game, ui):
+    game.next_turn()
+    ui.turn = game.turn
+    if game.winner is not None:
+        return 'winner'
+    if game.turn == ui.engine:
+        return engine_move(game, ui)
+    return None
+
+
+def engine_move(game, ui):
+    '''Let the engine choose and play a move for the current player.'''
+    with ENGINE_SECONDS.time():
+        code = pondered_reply(game, ui)
+        if code is None:
+            code = state().engine_pool.submit(
+                engine.think, game.copy(), ui.engine_ms).result()
+    move = Move(to_coord(code & 63), to_coord(code >> 6 & 63), game,
+                promotion=PROMOTIONS.get(code >> 12))
+    with UPDATE_SECONDS.time():
+        game.update(move)
+    MOVES.labels('engine').inc()
+    state().journal.move(ui.game_id, game.movehistory[-1])
+    ui.empty = game.movehistory.empty()
+    ui.info = game.info
+    show_board(game, ui)
+    outcome = finish_turn(game, ui)
+    if outcome is None:
+        start_pondering(game, ui)
+    return outcome
+
+
+def start_pondering(game, ui):
+    '''
+    If it is the human's turn against the engine, start working
+    out the engine's replies to their likeliest moves.
+    '''
+    shared = state()
+    if shared.ponder_pool is None or ui.engine is None \
+            or game.turn == ui.engine or game.winner is not None:
+        return
+    stop_pondering(ui)
+    shared.pondering.put(ui.game_id, engine.Ponder(
+        shared.ponder_pool, game.copy(), ui.engine_ms,
+        current_app.config['PONDER_MOVES']))
+
+
+def stop_pondering(ui):
+    '''Drop whatever was being pondered for the game.'''
+    ponder = state().pondering.pop(ui.game_id)
+    if ponder is not None:
+        ponder.cancel()
+
+
+def pondered_reply(game, ui):
+    '''
+    The engine's pondered reply to the move just played, if there
+    is one; any other pondering for the game is dropped.
+
+    Returns:
+    packed move int, or None
+    '''
+    ponder = state().pondering.pop(ui.game_id)
+    if ponder is None:
+        return None
+    code = ponder.reply(game)
+    # The position hash picked the reply; make sure it fits
+    if code is None or code not in game._legal_moves():
+        PONDERED.labels('miss').inc()
+        return None
+    PONDERED.labels('hit').inc()
+    return code
+
+
+def board_delta(before, after):
+    '''
+    The squares that differ between two boards from display(),
+    as {'<col><row>': image name}.
+    '''
+    delta = {}
+    for row_before, row_after in zip(before[1:], after[1:]):
+        row = row_after[0]
+        for col, (old, new) in enumerate(zip(row_before[1:], row_after[1:])):
+            if old != new:
+                delta[f'{col}{row}'] = new
+    return delta
+
+
+def share_update(game, ui, before, outcome):
+    '''
+    Build the JSON update for the squares changed since `before`
+    plus the game status, and when the position changed, publish
+    it once to the game's stream for its other browsers and its
+    spectators.
+    '''
+    update = {
+        'squares': board_delta(before, ui.board),
+        'info': ui.info,
+        'errmsg': ui.errmsg,
+        'turn': ui.turn,
+        'winner': game.winner,
+        'promote': outcome == 'promote',
+        'empty': ui.empty,
+        'score': ui.score,
+        'eval_bar': ui.eval_bar,
+    }
+    if ui.errmsg is None:
+        state().channel.publish(ui.watch_id, dict(update, errmsg=None))
+    return update
+
+
+def send_update(game, ui, before, outcome):
+    '''share_update(), answered as JSON.'''
+    return jsonify(share_update(game, ui, before, outcome))
+
+
+def board_html(game, ui, orientation='white'):
+    '''
+    The board table for `game` seen from `orientation`'s side,
+    rendered once per position and then served from the board cache.
+    '''
+    key = (game.hash, orientation)
+    board_cache = state().board_cache
+    html = board_cache.get(key)
+    if html is None:
+        board = ui.board
+        if orientation == 'black':
+            # Reverse the rows and columns, keeping the labels first
+            board = [board[0][:1] + board[0][:0:-1]] \
+                + [row[:1] + row[:0:-1] for row in board[:0:-1]]
+        html = Markup(render_template('board.html', board=board))
+        board_cache.put(key, html)
+    return html
+
+
+def page_etag(game, ui, orientation):
+    '''ETag covering everything shown on the board page.'''
+    state = (game.hash, orientation, ui.info, ui.errmsg, ui.turn,
+             ui.empty, ui.game_id, current_app.config['STREAM_PORT'])
+    return hashlib.blake2b(repr(state).encode(), digest_size=12).hexdigest()
+
+
+def render_board(game, ui):
+    '''
+    Render the board page. A GET whose If-None-Match matches the
+    page's ETag gets 304 Not Modified without rendering anything.
+    '''
+    orientation = request.args.get('orientation', 'white')
+    if orientation not in COLOURS:
+        orientation = 'white'
+    etag = page_etag(game, ui, orientation)
+    if request.method == 'GET' and etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        response = make_response(render_template(
+            'chess.html', ui=ui,
+            board_html=board_html(game, ui, orientation),
+            stream_port=current_app.config['STREAM_PORT']))
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+
+def load_position(fen):
+    '''
+    A new Board set up from `fen`. Parsed positions are kept in
+    the position cache, so a popular puzzle is only parsed once.
+
+    Raises:
+    ValueError if `fen` is not a valid position
+    '''
+    key = ' '.join(fen.split())
+    position_cache = state().position_cache
+    board = position_cache.get(key)
+    if board is None:
+        board = Board.from_fen(key)
+        board.check_game_over()
+        position_cache.put(key, board)
+    board = board.copy()
+    # The copy shares the cached list of legal moves
+    board.check_game_over()
+    return board
+
+
+def start_game(session, engine=None, engine_ms=None, fen=None):
+    '''
+    Set up a new session's board and interface, from the usual
+    starting position or from `fen`.
+    '''
+    if fen is None:
+        session.board.start()
+    else:
+        session.board = load_position(fen)
+    game = session.board
+    ui = session.ui
+    ui.engine = engine
+    ui.engine_ms = engine_ms
+    show_board(game, ui)
     ui.turn = game.turn
     ui.inputlabel = f'{game.turn} player: '
     ui.errmsg = None
     ui.btnlabel = 'Move'
     ui.info = game.info
-    return redirect('/play')
+    ui.game_id = session.id
+    ui.watch_id = session.watch_id
+
+
+def recover_games(shared):
+    '''Rebuild the games in progress from `shared`'s journals.'''
+    for game_id, records in shared.journal.load():
+        session = shared.games.restore(game_id)
+        start_game(session, *game_settings(records))
+        game, ui = session.board, session.ui
+        replay(game, records)
+        ui.turn = game.turn
+        ui.empty = game.movehistory.empty()
+        show_board(game, ui)
 
+@bp.route('/')
+def root():
+    return render_template('index.html')
 
-@app.route('/play', methods=['GET', 'POST'])
-def play():
-    # TODO: get player move from GET request object
-    # TODO: if there is no player move, render the page template
+def open_game(fen=None):
+    '''
+    Start a game for the player and send them to it. With
+    ?vs=engine&ms=... the engine plays black.
+    '''
+    engine = engine_ms = None
+    if request.args.get('vs') == 'engine':
+        engine = 'black'
+        config = current_app.config
+        ms = request.args.get('ms', config['ENGINE_MS'], type=int)
+        engine_ms = max(10, min(ms, config['ENGINE_MAX_MS']))
+    games = state().games
+    with games.checkout(games.new().id) as session:
+        start_game(session, engine, engine_ms, fen)
+        state().journal.new(session.id, engine, engine_ms, fen)
+        GAMES_STARTED.inc()
+        game, ui = session.board, session.ui
+        if game.winner is None and game.turn == ui.engine:
+            engine_move(game, ui)
+        else:
+            start_pondering(game, ui)
+    response = redirect('/winner' if game.winner is not None else '/play')
+    response.set_cookie('game_id', session.id, httponly=True,
+                        samesite='Lax')
+    return response
+
+@bp.route('/newgame')
+def newgame():
+    return open_game()
+
+@bp.route('/position')
+def position():
+    '''Start a game from the FEN in ?fen=...'''
+    fen = request.args.get('fen', '')
+    try:
+        load_position(fen)
+    except ValueError as e:
+        abort(400, f'Invalid FEN: {e}')
+    return open_game(fen)
+
+
+@bp.route('/play', methods=['GET', 'POST'])
+@with_game
+def play(game, ui):
     move = request.form.get("move", None)
     ui.empty = game.movehistory.empty()
     if move is None:
-        return render_template('chess.html', ui=ui)
-    else:
-        ui.empty = game.movehistory.empty()
-        valid, output = game.prompt(move)
-        if not valid:
-            ui.errmsg = output
-            return render_template('chess.html', ui=ui)
-        else:
-            ui.errmsg = None
-            game.update(output)
-            ui.empty = game.movehistory.empty()
-            if game.winner is not None:
-                return redirect('/winner')
-            ui.info = game.info
-            ui.board = game.display()
-            if game.promotepawns():
-                return redirect('/promote')
-            else:
-                game.next_turn()
-                ui.turn = game.turn
-                return render_template('chess.html', ui=ui)
-
-    # TODO: Validate move, redirect player back to /play again if move is invalid
-    # If move is valid, check for pawns to promote
-    # Redirect to /promote if there are pawns to promote, otherwise 
-
-@app.route('/promote')
-def promote():
+        return render_board(game, ui)
+    before = ui.board
+    outcome = play_move(game, ui, move)
+    share_update(game, ui, before, outcome)
+    if outcome == 'winner':
+        return redirect('/winner')
+    elif outcome == 'promote':
+        return redirect('/promote')
+    return render_board(game, ui)
+
+@bp.route('/promote')
+@with_game
+def promote(game, ui):
     piece = request.args.get("promote", None)
     if piece is None:
-        return render_template("promote.html", ui=ui)
-    else:
-        if piece == 'Rook':
-            PieceClass = Rook
-        elif piece == 'Knight':
-            PieceClass = Knight
-        elif piece == 'Bishop':
-            PieceClass = Bishop
-        elif piece == 'Queen':
-            PieceClass = Queen
-        game.promotepawns(PieceClass)
-        game.next_turn()
-        ui.turn = game.turn
-        ui.board = game.display()
-        ui.info = game.info
-        return redirect("/play")
-
-@app.route('/undo')
-def undo():
-    move = game.movehistory.pop()
-    game.undo(move)
-    game.next_turn()
-    ui.turn = game.turn
-    ui.board = game.display()
-    ui.info = f"undo {game.info}"
+        return render_template("promote.html", ui=ui,
+                               board_html=board_html(game, ui))
+    before = ui.board
+    outcome = promote_pawn(game, ui, piece)
+    share_update(game, ui, before, outcome)
+    if outcome == 'winner':
+        return redirect('/winner')
+    elif outcome == 'promote':
+        return render_template("promote.html", ui=ui,
+                               board_html=board_html(game, ui))
+    return redirect("/play")
+
+@bp.route('/undo')
+@with_game
+def undo(game, ui):
+    before = ui.board
+    share_update(game, ui, before, undo_move(game, ui))
     return redirect("/play")
 
-@app.route("/winner")
-def winner():
+
+@bp.route('/watch/<watch_id>')
+def watch(watch_id):
+    '''
+    Read-only page following a game live, for spectators. After
+    loading it they get each move from the game's event stream,
+    like the players' own tabs, without coming back here.
+    '''
+    games = state().games
+    session = games.peek(games.find(watch_id))
+    if session is None:
+        abort(404)
+    game, ui = session.board, session.ui
+    orientation = request.args.get('orientation', 'white')
+    if orientation not in COLOURS:
+        orientation = 'white'
+    etag = page_etag(game, ui, orientation)
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        response = make_response(render_template(
+            'watch.html', ui=ui, winner=game.winner,
+            board_html=board_html(game, ui, orientation),
+            stream_port=current_app.config['STREAM_PORT']))
+    response.set_etag(etag)
+    response.cache_control.no_cache = True
+    return response
+
+# JSON versions of /play, /promote and /undo for the page script.
+# They answer with only the squares that changed.
+
+def json_body():
+    '''
+    The JSON object a request sent, or {} if it sent no JSON.
+    Anything else aborts with 400.
+    '''
+    data = request.get_json(silent=True)
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        abort(400, 'Expected a JSON object')
+    return data
+
+@bp.route('/api/move', methods=['POST'])
+@with_game
+def api_move(game, ui):
+    move = json_body().get('move')
+    if not isinstance(move, str):
+        abort(400, 'Expected {"move": "41 43"}')
+    before = ui.board
+    return send_update(game, ui, before, play_move(game, ui, move))
+
+@bp.route('/api/promote', methods=['POST'])
+@with_game
+def api_promote(game, ui):
+    piece = json_body().get('promote')
+    if not isinstance(piece, str):
+        abort(400, 'Expected {"promote": "Queen"}')
+    before = ui.board
+    return send_update(game, ui, before, promote_pawn(game, ui, piece))
+
+@bp.route('/api/undo', methods=['POST'])
+@with_game
+def api_undo(game, ui):
+    before = ui.board
+    return send_update(game, ui, before, undo_move(game, ui))
+
+@bp.route('/api/moves', methods=['GET', 'POST'])
+@with_game
+def api_moves(game, ui):
+    '''
+    The current player's legal moves, for move hints. A GET
+    answers {"turn": ..., "moves": {"41": ["42", "43"], ...}}, the
+    squares each piece can move to, named as in /play. A POST of
+    {"moves": ["41 43", ...]} answers {"valid": [true, ...]},
+    whether each candidate is legal now. Both are looked up in the
+    board's set of legal moves, which is made once per position.
+    '''
+    waiting = game.winner is not None or bool(game.promotepawns())
+    if request.method == 'GET':
+        with LEGAL_MOVES_SECONDS.time():
+            targets = {} if waiting else game.legal_targets()
+        return jsonify({'turn': game.turn, 'moves': {
+            f'{col}{row}': [f'{c}{r}' for c, r in ends]
+            for (col, row), ends in targets.items()}})
+    candidates = json_body().get('moves')
+    if not isinstance(candidates, list):
+        abort(400, 'Expected {"moves": [...]}')
+    valid = []
+    with LEGAL_MOVES_SECONDS.time():
+        for move in candidates:
+            coords = None if waiting else parse_move(move)
+            valid.append(coords is not None and game.is_legal(*coords))
+    return jsonify({'valid': valid})
+
+@bp.route('/analyse', methods=['POST'])
+def analyse():
+    '''
+    Score every position of a game. Takes JSON {"moves": [...]}
+    in long algebraic notation (e.g. "e2e4", "e7e8q"), plus "fen"
+    for games that do not start from the usual position, and
+    answers with lists of material, piece_square, mobility and
+    total scores, one per position from the start to the end.
+    '''
+    if analysis is None:
+        abort(501, 'Analysis needs NumPy')
+    data = json_body()
+    moves = data.get('moves')
+    fen = data.get('fen')
+    if not isinstance(moves, list) \
+            or not all(isinstance(move, str) for move in moves) \
+            or fen is not None and not isinstance(fen, str):
+        abort(400, 'Expected {"moves": [...], "fen": ...}')
+    if len(moves) > current_app.config['ANALYSE_MAX_PLIES']:
+        abort(400, 'Too many moves')
+    try:
+        positions = analysis.game_positions(moves, fen)
+    except (MoveError, ValueError) as e:
+        abort(400, str(e))
+    scores = analysis.evaluate(positions)
+    return jsonify({name: values.tolist() for name, values in scores.items()})
+
+@bp.route('/metrics')
+def metrics_page():
+    '''Metrics in the Prometheus text format.'''
+    response = make_response(metrics.render())
+    response.mimetype = 'text/plain'
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+    return response
+
+@bp.route("/winner")
+@with_game
+def winner(game, ui):
     winner = game.winner
     return render_template("winner.html", winner = winner)
 
-app.run()
\ No newline at end of file
+if __name__ == '__main__':
+    # The development server; see serve.py for several processes
+    # and for deploying behind a WSGI server
+    app = create_app()
+    app.extensions['chess'].channel.start(port=app.config['STREAM_PORT'])
+    app.run()
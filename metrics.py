@@ -0,0 +1,183 @@
+'''
+Counters, gauges and latency histograms, rendered in the
+Prometheus text format for the /metrics route.
+
+Updating a metric takes a lock and a few additions, so they are
+cheap enough to leave on everywhere:
+
+    moves = Counter('chess_moves_total', 'Moves played.')
+    moves.inc()
+
+    latency = Histogram('chess_request_seconds', 'Request time.',
+                        label='route')
+    with latency.labels('/play').time():
+        ...
+'''
+import abc
+import threading
+import time
+from bisect import bisect_left
+
+
+# Upper bounds in seconds, from 100us to 10s
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Every metric created, in order, for render()
+registry = []
+
+
+class Metric(abc.ABC):
+    '''
+    Base class of the metric types. A metric with a `label` keeps
+    one child metric per label value (see labels()); otherwise it
+    records values itself.
+    '''
+    kind = None
+
+    def __init__(self, name, help, label=None, register=True):
+        self.name = name
+        self.help = help
+        self.label = label
+        self._children = {}
+        self._lock = threading.Lock()
+        if register:
+            registry.append(self)
+
+    def labels(self, value):
+        '''The child metric for label value `value`.'''
+        child = self._children.get(value)
+        if child is None:
+            with self._lock:
+                child = self._children.get(value)
+                if child is None:
+                    child = self._children[value] = self._child()
+        return child
+
+    @abc.abstractmethod
+    def _child(self):
+        '''A new unregistered metric for one label value.'''
+
+    @abc.abstractmethod
+    def _samples(self):
+        '''Yield (suffix, labels, value) for each line of output.'''
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help}',
+                 f'# TYPE {self.name} {self.kind}']
+        if self.label is None:
+            metrics = [('', self)]
+        else:
+            metrics = [(f'{self.label}="{escape(value)}"', child)
+                       for value, child in sorted(self._children.items())]
+        for labels, metric in metrics:
+            for suffix, extra, value in metric._samples():
+                labelset = ','.join(filter(None, (labels, extra)))
+                if labelset:
+                    labelset = '{' + labelset + '}'
+                lines.append(f'{self.name}{suffix}{labelset} {value!r}')
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    '''A count that only goes up.'''
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.value = 0
+
+    def _child(self):
+        return Counter(self.name, self.help, register=False)
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def _samples(self):
+        yield '', '', self.value
+
+
+class Gauge(Metric):
+    '''A value read from `function` whenever metrics are rendered.'''
+    kind = 'gauge'
+
+    def __init__(self, name, help, function):
+        super().__init__(name, help)
+        self.function = function
+
+    def _child(self):
+        raise TypeError(f'{self.name} has no labels')
+
+    def _samples(self):
+        yield '', '', self.function()
+
+
+class FunctionCounter(Gauge):
+    '''
+    A count that only goes up, read from `function` whenever
+    metrics are rendered, for counts kept elsewhere (such as a
+    cache's hits).
+    '''
+    kind = 'counter'
+
+
+class Histogram(Metric):
+    '''Counts of observed values by bucket, plus their sum.'''
+    kind = 'histogram'
+
+    def __init__(self, name, help, label=None, buckets=DEFAULT_BUCKETS,
+                 register=True):
+        super().__init__(name, help, label, register)
+        self.buckets = tuple(buckets)
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+
+    def _child(self):
+        return Histogram(self.name, self.help, buckets=self.buckets,
+                         register=False)
+
+    def observe(self, value):
+        bucket = bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[bucket] += 1
+            self.count += 1
+            self.sum += value
+
+    def time(self):
+        '''Context manager that observes the time its body takes.'''
+        return Timer(self)
+
+    def _samples(self):
+        total = 0
+        for bound, count in zip(self.buckets, self._counts):
+            total += count
+            yield '_bucket', f'le="{bound:g}"', total
+        yield '_bucket', 'le="+Inf"', self.count
+        yield '_sum', '', self.sum
+        yield '_count', '', self.count
+
+
+class Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+def escape(value):
+    return str(value).replace('\\', r'\\').replace('"', r'\"') \
+        .replace('\n', r'\n')
+
+
+def render():
+    '''Every registered metric in the Prometheus text format.'''
+    return '\n'.join(metric.render() for metric in registry) + '\n'
@@ -0,0 +1,291 @@
+'''
+Bulk PGN import: checks every move of every game in one or more
+PGN files against the rules in chess.py and reports the games
+with illegal or unreadable moves.
+
+Files are read one game at a time and the games are checked in
+a pool of worker processes, a batch at a time, with only a few
+batches in flight, so memory use does not grow with file size.
+
+Run from the repository root:
+    python pgn.py games.pgn more-games.pgn
+    python pgn.py --workers 4 --batch 200 archive.pgn
+'''
+import argparse
+import multiprocessing
+import os
+import re
+import sys
+import time
+from collections import Counter, deque
+
+from chess import Board, Move, MoveError, PROMOTIONS, to_coord
+
+
+HEADER = re.compile(r'\[(\w+)\s+"((?:[^"\\]|\\.)*)"\]')
+MOVE_NUMBER = re.compile(r'\d+\.+')
+SAN = re.compile(r'([NBRQK])?([a-h])?([1-8])?x?([a-h][1-8])(?:=?([NBRQ]))?')
+RESULTS = ('1-0', '0-1', '1/2-1/2', '*')
+
+# Castling as the king's start and end squares, by side to move
+CASTLES = {
+    ('white', 'O-O'): (4, 6), ('white', 'O-O-O'): (4, 2),
+    ('black', 'O-O'): (60, 62), ('black', 'O-O-O'): (60, 58),
+}
+PIECE_LETTERS = {'N': 'n', 'B': 'b', 'R': 'r', 'Q': 'q', 'K': 'k'}
+
+
+class Game:
+    '''
+    One game read from a PGN file.
+
+    ATTRIBUTES
+
+    path <str>, line <int>
+        Where the game starts.
+
+    headers <dict>
+        The tag pairs, e.g. {'White': 'Morphy', ...}
+
+    moves <list of str>
+        The moves in standard algebraic notation.
+
+    result <str or None>
+        The game termination marker, e.g. '1-0'.
+    '''
+    __slots__ = ('path', 'line', 'headers', 'moves', 'result')
+
+    def __init__(self, path, line):
+        self.path = path
+        self.line = line
+        self.headers = {}
+        self.moves = []
+        self.result = None
+
+    def __str__(self):
+        white = self.headers.get('White', '?')
+        black = self.headers.get('Black', '?')
+        return f'{self.path}:{self.line} ({white} vs {black})'
+
+
+def tokens(text, depth=0):
+    '''
+    Split movetext into moves and result markers, skipping
+    comments, variations, NAGs and move numbers.
+
+    Returns:
+    (list of tokens, variation depth left open at the end of `text`)
+    '''
+    found = []
+    pos = 0
+    while pos < len(text):
+        char = text[pos]
+        if char == '{':
+            close = text.find('}', pos)
+            pos = len(text) if close < 0 else close + 1
+            continue
+        if char == ';':
+            break
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        elif not char.isspace():
+            end = pos
+            while end < len(text) and not text[end].isspace() \
+                    and text[end] not in '{;()':
+                end += 1
+            word = MOVE_NUMBER.sub('', text[pos:end])
+            if depth == 0 and word and not word.startswith('$'):
+                found.append(word)
+            pos = end
+            continue
+        pos += 1
+    return found, depth
+
+
+def read_games(path):
+    '''Yield the Games in the PGN file at `path`, one at a time.'''
+    game = None
+    depth = 0
+    in_comment = False
+    with open(path, encoding='utf-8', errors='replace') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if in_comment:
+                close = line.find('}')
+                if close < 0:
+                    continue
+                line = line[close + 1:]
+                in_comment = False
+            if line.startswith('['):
+                match = HEADER.match(line)
+                if match is None:
+                    continue
+                if game is None or game.moves or game.result:
+                    if game is not None:
+                        yield game
+                    game = Game(path, number)
+                    depth = 0
+                game.headers[match.group(1)] = match.group(2)
+                continue
+            if not line or line.startswith('%'):
+                continue
+            if game is None:
+                game = Game(path, number)
+            # A comment left open continues on the next line
+            if line.rfind('{') > line.rfind('}'):
+                in_comment = True
+            words, depth = tokens(line, depth)
+            for word in words:
+                if word in RESULTS:
+                    game.result = word
+                else:
+                    game.moves.append(word)
+    if game is not None:
+        yield game
+
+
+def find_move(board, san, moves):
+    '''
+    The legal packed move in `moves` that the SAN string `san`
+    stands for.
+
+    Raises:
+    MoveError if `san` is unreadable, illegal or ambiguous
+    '''
+    san = san.rstrip('+#!?').replace('0', 'O')
+    mailbox = board._mailbox
+    castle = CASTLES.get((board.turn, san))
+    if castle is not None:
+        start, end = castle
+        found = [move for move in moves
+                 if move & 63 == start and move >> 6 & 63 == end
+                 and mailbox[start].symbol == 'k']
+    else:
+        match = SAN.fullmatch(san)
+        if match is None:
+            raise MoveError(f'Cannot read move {san}')
+        piece, file, rank, square, promotion = match.groups()
+        symbol = PIECE_LETTERS.get(piece, 'p')
+        end = 'abcdefgh'.index(square[0]) + 8 * (int(square[1]) - 1)
+        promotion = promotion and promotion.lower()
+        found = []
+        for move in moves:
+            start = move & 63
+            if move >> 6 & 63 != end or mailbox[start].symbol != symbol \
+                    or file and 'abcdefgh'[start & 7] != file \
+                    or rank and str((start >> 3) + 1) != rank:
+                continue
+            promoted = PROMOTIONS.get(move >> 12)
+            if (promoted and promoted.symbol) != promotion:
+                continue
+            found.append(move)
+    if not found:
+        raise MoveError(f'Illegal move {san}')
+    if len(found) > 1:
+        raise MoveError(f'Ambiguous move {san}')
+    return found[0]
+
+
+def check_game(game):
+    '''
+    Play `game` from the starting position, or the position
+    in its FEN tag.
+
+    Returns:
+    (number of moves played, error message or None)
+    '''
+    if 'FEN' in game.headers:
+        try:
+            board = Board.from_fen(game.headers['FEN'])
+        except ValueError as e:
+            return 0, f'FEN tag: {e}'
+        board.check_game_over()
+    else:
+        board = Board()
+        board.start()
+    for ply, san in enumerate(game.moves):
+        dots = '.' if board.turn == 'white' else '...'
+        where = f'move {board.fullmove_number}{dots} {san}'
+        if board.winner is not None:
+            return ply, f'{where}: played after the game ended'
+        try:
+            code = find_move(board, san, board._legal_moves())
+            board.update(Move(to_coord(code & 63), to_coord(code >> 6 & 63),
+                              board, promotion=PROMOTIONS.get(code >> 12)))
+        except MoveError as e:
+            return ply, f'{where}: {e}'
+        board.next_turn()
+    return len(game.moves), None
+
+
+def check_batch(games):
+    '''check_game() for each of `games`, in a worker process.'''
+    return [(str(game), game.result, check_game(game)) for game in games]
+
+
+def batches(paths, size):
+    batch = []
+    for path in paths:
+        for game in read_games(path):
+            batch.append(game)
+            if len(batch) == size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('paths', nargs='+', metavar='FILE',
+                        help='PGN file to check')
+    parser.add_argument('--workers', type=int,
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('--batch', type=int, default=100,
+                        help='games sent to a worker at a time')
+    parser.add_argument('--quiet', action='store_true',
+                        help='only print the summary')
+    args = parser.parse_args(argv)
+
+    games = moves = 0
+    errors = 0
+    results = Counter()
+    start = time.perf_counter()
+
+    def report(checked):
+        nonlocal games, moves, errors
+        for name, result, (played, error) in checked:
+            games += 1
+            moves += played
+            results[result or 'none'] += 1
+            if error is not None:
+                errors += 1
+                if not args.quiet:
+                    print(f'{name}: {error}')
+
+    workers = args.workers or os.cpu_count() or 1
+    with multiprocessing.Pool(workers) as pool:
+        # A couple of batches per worker keeps them all busy
+        # without reading the whole file ahead
+        limit = 2 * workers
+        pending = deque()
+        for batch in batches(args.paths, args.batch):
+            pending.append(pool.apply_async(check_batch, (batch,)))
+            if len(pending) >= limit:
+                report(pending.popleft().get())
+        while pending:
+            report(pending.popleft().get())
+
+    elapsed = time.perf_counter() - start
+    print(f'{games} games, {moves} moves in {elapsed:.2f}s '
+          f'({games / elapsed:.0f} games/s, {moves / elapsed:.0f} moves/s)')
+    print(f'{games - errors} valid, {errors} with errors')
+    print('results: ' + ', '.join(f'{result} {count}'
+                                  for result, count in results.most_common()))
+    return 1 if errors else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,159 @@
+'''
+Multi-process runner: runs the app in several worker processes
+that accept connections from one shared listening socket, so that
+every core serves requests.
+
+Games are kept in SQLite (store.SQLiteGameStore), so any worker
+can serve any request for any game and no sticky sessions are
+needed. One more process runs the server-sent events channel,
+and the workers relay their events to it. The master process
+only starts the others and restarts any that die.
+
+Each worker serves HTTP with Werkzeug's development server, which
+is fine on a trusted network but is not hardened for the open
+internet. To deploy, serve the app factory through a WSGI server
+instead, with the same settings, and run only the channel here:
+
+    python serve.py --channel-only
+    gunicorn -w 8 'main:create_app(GAME_STORE="sqlite", STREAM_RELAY_PORT=5002)'
+
+Run from the repository root:
+    python serve.py
+    python serve.py --workers 8 --host 0.0.0.0 --port 8000
+'''
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+from werkzeug.serving import make_server
+
+import main as chess_app
+from stream import EventChannel
+
+
+logger = logging.getLogger('serve')
+
+
+def run_worker(sock, config):
+    '''Serve the app on `sock` until killed.'''
+    app = chess_app.create_app(**config)
+    host, port = sock.getsockname()[:2]
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    try:
+        server.serve_forever()
+    finally:
+        app.extensions['chess'].close()
+
+
+def run_channel(host, port, relay_port):
+    '''Serve event streams until killed.'''
+    EventChannel().start(host, port, relay_port=relay_port)
+    while True:
+        signal.pause()
+
+
+def spawn(target, *args):
+    '''Run target(*args) in a child process and return its pid.'''
+    pid = os.fork()
+    if pid:
+        return pid
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    status = 1
+    try:
+        target(*args)
+        status = 0
+    except (KeyboardInterrupt, SystemExit):
+        status = 0
+    except BaseException:
+        logger.exception('%s failed', target.__name__)
+    finally:
+        os._exit(status)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on')
+    parser.add_argument('--port', type=int, default=8000,
+                        help='port of the app')
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='app processes (default: one per CPU)')
+    parser.add_argument('--stream-port', type=int, default=5001,
+                        help='port of the event channel')
+    parser.add_argument('--relay-port', type=int, default=5002,
+                        help='localhost UDP port workers send events to')
+    parser.add_argument('--ponder', type=int, default=0, metavar='MOVES',
+                        help='human moves to prepare engine replies to '
+                        '(default: 0; a reply only helps if the move '
+                        'reaches the worker that pondered it)')
+    parser.add_argument('--channel-only', action='store_true',
+                        help='run only the event channel, for an app '
+                        'served by a WSGI server')
+    parser.add_argument('--db', help='SQLite file of the games '
+                        '(default: instance/games.sqlite3)')
+    args = parser.parse_args(argv)
+    if args.workers < 1:
+        parser.error('--workers must be at least 1')
+    logging.basicConfig(level=logging.INFO,
+                        format='[%(process)d] %(message)s')
+
+    config = {
+        'GAME_STORE': 'sqlite',
+        'STREAM_PORT': args.stream_port,
+        'STREAM_RELAY_PORT': args.relay_port,
+        # Share the cores between the workers' engine pools
+        'ENGINE_WORKERS': max(1, (os.cpu_count() or 1) // args.workers),
+        'PONDER_MOVES': args.ponder,
+    }
+    if args.db:
+        config['GAME_DB'] = args.db
+    roles = {
+        'channel': (run_channel, args.host, args.stream_port,
+                    args.relay_port),
+    }
+    children = {spawn(*roles['channel']): 'channel'}
+    if args.channel_only:
+        logger.info('Event channel on http://%s:%d, relayed on port %d',
+                    args.host, args.stream_port, args.relay_port)
+    else:
+        sock = socket.create_server((args.host, args.port), backlog=1024)
+        roles['worker'] = (run_worker, sock, config)
+        for _ in range(args.workers):
+            children[spawn(*roles['worker'])] = 'worker'
+        logger.info('Serving on http://%s:%d with %d workers',
+                    args.host, args.port, args.workers)
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while children:
+        pid, status = os.wait()
+        role = children.pop(pid, None)
+        if role is None or stopping:
+            continue
+        logger.warning('%s %d exited with status %d; restarting',
+                       role, pid, os.waitstatus_to_exitcode(status))
+        # Don't spin if a worker dies straight away every time
+        time.sleep(1)
+        if not stopping:
+            children[spawn(*roles[role])] = role
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,75 @@
+// Plays moves through the JSON api and patches the squares that
+// changed, instead of reloading the whole page after every move.
+// Updates made from other tabs arrive over the event stream.
+(function () {
+    var body = document.body;
+    var moveForm = document.getElementById('moveform');
+    var moveInput = document.getElementById('move');
+    var undoForm = document.getElementById('undoform');
+    var promote = document.getElementById('promote');
+
+    function setAlert(id, text) {
+        var alert = document.getElementById(id);
+        alert.hidden = text === null;
+        alert.querySelector('span').textContent = text;
+    }
+
+    function apply(update) {
+        if (update.winner) {
+            window.location = '/winner';
+            return;
+        }
+        for (var square in update.squares) {
+            document.getElementById('sq' + square).className =
+                'piece piece-' + update.squares[square];
+        }
+        setAlert('errmsg', update.errmsg);
+        setAlert('info', update.info);
+        document.getElementById('evalbar').style.width = update.eval_bar + '%';
+        document.getElementById('score').textContent =
+            (update.score >= 0 ? '+' : '') + (update.score / 100).toFixed(2);
+        moveInput.placeholder = update.turn + ' player';
+        undoForm.hidden = update.empty;
+        promote.hidden = !update.promote;
+        moveForm.hidden = update.promote;
+    }
+
+    function post(url, data) {
+        return fetch(url, {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            credentials: 'same-origin',
+            body: JSON.stringify(data)
+        }).then(function (response) {
+            if (response.redirected) {
+                window.location = response.url;
+                return;
+            }
+            return response.json().then(apply);
+        });
+    }
+
+    moveForm.addEventListener('submit', function (event) {
+        event.preventDefault();
+        post('/api/move', {move: moveInput.value});
+        moveInput.value = '';
+    });
+    undoForm.addEventListener('submit', function (event) {
+        event.preventDefault();
+        post('/api/undo', {});
+    });
+    promote.querySelectorAll('input').forEach(function (button) {
+        button.addEventListener('click', function () {
+            post('/api/promote', {promote: button.value});
+        });
+    });
+
+    if (window.EventSource && body.dataset.watch) {
+        var events = new EventSource(
+            location.protocol + '//' + location.hostname + ':' +
+            body.dataset.streamPort + '/events/' + body.dataset.watch);
+        events.onmessage = function (event) {
+            apply(JSON.parse(event.data));
+        };
+    }
+})();
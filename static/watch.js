@@ -0,0 +1,48 @@
+// Follows a game for a spectator: patches the squares that changed
+// as updates arrive over the game's event stream. Updates only say
+// what changed, so after a dropped connection the page is reloaded
+// to catch up.
+(function () {
+    var body = document.body;
+
+    function setAlert(id, text) {
+        var alert = document.getElementById(id);
+        alert.hidden = text === null;
+        alert.querySelector('span').textContent = text;
+    }
+
+    function apply(update) {
+        for (var square in update.squares) {
+            document.getElementById('sq' + square).className =
+                'piece piece-' + update.squares[square];
+        }
+        setAlert('info', update.info);
+        document.getElementById('evalbar').style.width = update.eval_bar + '%';
+        document.getElementById('score').textContent =
+            (update.score >= 0 ? '+' : '') + (update.score / 100).toFixed(2);
+        if (update.winner) {
+            setAlert('turn', null);
+            setAlert('winner', update.winner === 'draw' ?
+                     'the game is a draw' : update.winner + ' won');
+        } else {
+            setAlert('turn', update.turn);
+            setAlert('winner', null);
+        }
+    }
+
+    if (window.EventSource && body.dataset.watch) {
+        var connected = false;
+        var events = new EventSource(
+            location.protocol + '//' + location.hostname + ':' +
+            body.dataset.streamPort + '/events/' + body.dataset.watch);
+        events.onopen = function () {
+            if (connected) {
+                location.reload();
+            }
+            connected = true;
+        };
+        events.onmessage = function (event) {
+            apply(JSON.parse(event.data));
+        };
+    }
+})();
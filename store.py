@@ -0,0 +1,394 @@
+'''
+Registries of the games being played, so that each player gets
+their own Board instead of sharing one global game.
+
+GameStore keeps games in memory, for a server with a single
+process. SQLiteGameStore keeps them in a database file that
+several server processes share, so any of them can serve any
+request for any game.
+'''
+import base64
+import contextlib
+import fcntl
+import hashlib
+import os
+import pickle
+import secrets
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from chess import Board, WebInterface
+
+
+def watch_id(game_id):
+    '''
+    The public id spectators follow a game by. It is a hash of
+    the game id, which lets whoever holds it play, so the game id
+    cannot be worked out from it.
+    '''
+    digest = hashlib.blake2b(game_id.encode(), digest_size=12,
+                             person=b'chess-watch').digest()
+    return base64.urlsafe_b64encode(digest).decode()
+
+
+class GameSession:
+    '''
+    One player's game: the Board, its WebInterface and a lock
+    that is held while a request works on them.
+    '''
+    def __init__(self, game_id, board=None, ui=None):
+        self.id = game_id
+        self.watch_id = watch_id(game_id)
+        self.board = Board(debug=False) if board is None else board
+        self.ui = WebInterface() if ui is None else ui
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        # Copy made by GameStore.peek(), and the (Board.hash, moves
+        # made) it was made at
+        self.snapshot = None
+        self.snapshot_of = None
+
+    def copy(self):
+        '''A GameSession with copies of this one's board and ui.'''
+        return GameSession(self.id, *pickle.loads(pickle.dumps(
+            (self.board, self.ui), protocol=pickle.HIGHEST_PROTOCOL)))
+
+
+class GameStore:
+    '''
+    Maps game ids to GameSessions, least recently used first.
+
+    Games idle for longer than `ttl` seconds are evicted, and
+    once `max_games` games exist the least recently used one is
+    evicted to make room, which caps the memory the store uses.
+    If a GameJournal is given, the journals of games that are
+    evicted or removed are deleted with them.
+
+    METHODS
+
+    new()
+        Create and register a new GameSession.
+
+    restore(game_id)
+        Register a new GameSession under an existing id, for
+        games recovered from a journal.
+
+    get(game_id)
+        The GameSession for `game_id`, or None if there is none
+        (or it was evicted).
+
+    checkout(game_id)
+        Context manager giving get(game_id) with the game's lock
+        held, so one request at a time works on it.
+
+    peek(game_id)
+        A copy of the GameSession for `game_id`, or None, to read
+        without holding up the game's players. Spectators share
+        it, so it must not be changed.
+
+    find(watch_id)
+        The id of the game with watch id `watch_id`, or None.
+
+    remove(game_id)
+        Forget a game.
+    '''
+    def __init__(self, max_games=10000, ttl=60 * 60, journal=None):
+        if max_games < 1:
+            raise ValueError('max_games must be at least 1')
+        self.max_games = max_games
+        self.ttl = ttl
+        self.journal = journal
+        self._games = OrderedDict()
+        self._watched = {}  # watch id -> game id
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._games)
+
+    def new(self):
+        return self.restore(secrets.token_urlsafe(16))
+
+    def restore(self, game_id):
+        game = GameSession(game_id)
+        with self._lock:
+            dropped = self._evict(game.last_used)
+            while len(self._games) >= self.max_games:
+                dropped.append(self._drop(next(iter(self._games))))
+            self._games[game.id] = game
+            self._watched[game.watch_id] = game.id
+        self._forget(dropped)
+        return game
+
+    def get(self, game_id):
+        if game_id is None:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            dropped = self._evict(now)
+            game = self._games.get(game_id)
+            if game is not None:
+                game.last_used = now
+                self._games.move_to_end(game_id)
+        self._forget(dropped)
+        return game
+
+    def find(self, watch_id):
+        with self._lock:
+            return self._watched.get(watch_id)
+
+    def peek(self, game_id):
+        '''
+        Neither waits for a request working on the game, which then
+        gets the copy made before it, nor counts as using the game.
+        The copy is only remade once a move has been made or undone.
+        '''
+        if game_id is None:
+            return None
+        with self._lock:
+            game = self._games.get(game_id)
+        if game is None or time.monotonic() - game.last_used > self.ttl:
+            return None
+        if game.lock.acquire(blocking=False):
+            try:
+                self._snapshot(game)
+            finally:
+                game.lock.release()
+        elif game.snapshot is None:
+            with game.lock:
+                self._snapshot(game)
+        return game.snapshot
+
+    @staticmethod
+    def _snapshot(game):
+        '''Copy `game` into game.snapshot if it changed. Needs game.lock.'''
+        version = (game.board.hash, len(game.board.movehistory))
+        if game.snapshot is None or game.snapshot_of != version:
+            game.snapshot = game.copy()
+            game.snapshot_of = version
+
+    @contextlib.contextmanager
+    def checkout(self, game_id):
+        game = self.get(game_id)
+        if game is None:
+            yield None
+            return
+        with game.lock:
+            yield game
+
+    def remove(self, game_id):
+        with self._lock:
+            dropped = [self._drop(game_id)]
+        self._forget(dropped)
+
+    def _drop(self, game_id):
+        '''Unregister a game and return its id, or None if unknown.'''
+        game = self._games.pop(game_id, None)
+        if game is None:
+            return None
+        del self._watched[game.watch_id]
+        return game_id
+
+    def _forget(self, game_ids):
+        '''
+        Delete the journals of games dropped from the store. This
+        waits for the journal's disk writes, so it is done after
+        releasing the store's lock.
+        '''
+        if self.journal is None:
+            return
+        for game_id in game_ids:
+            if game_id is not None:
+                self.journal.remove(game_id)
+
+    def _evict(self, now):
+        '''
+        Drop idle games from the least recently used end.
+
+        Returns:
+        list of the ids dropped, for _forget()
+        '''
+        games = self._games
+        dropped = []
+        while games:
+            game = next(iter(games.values()))
+            if now - game.last_used <= self.ttl:
+                break
+            dropped.append(self._drop(game.id))
+        return dropped
+
+
+class SQLiteGameStore:
+    '''
+    Keeps games in the SQLite database at `path`, to be shared by
+    every server process on a host. Eviction works as in
+    GameStore, by wall-clock time so that all processes agree.
+
+    A game is loaded for each request that checks it out and
+    saved back when the request is done with it. Requests for the
+    same game take turns through a lock on one byte of
+    `<path>.lock` per shard of game ids, plus a thread lock per
+    shard, since POSIX locks belong to a process rather than a
+    thread. Requests for different games only wait for SQLite's
+    brief write lock.
+
+    METHODS
+
+    new()
+        Create and save a new GameSession.
+
+    checkout(game_id)
+        Context manager giving the GameSession for `game_id` (or
+        None if there is none) while holding its lock, and saving
+        it when the block finishes without an exception.
+
+    peek(game_id)
+        The GameSession for `game_id`, or None, as last saved;
+        neither locked, saved nor counted as using the game.
+
+    find(watch_id)
+        The id of the game with watch id `watch_id`, or None.
+
+    remove(game_id)
+        Forget a game.
+    '''
+    shards = 1024
+
+    def __init__(self, path, max_games=10000, ttl=60 * 60):
+        if max_games < 1:
+            raise ValueError('max_games must be at least 1')
+        self.path = path
+        self.max_games = max_games
+        self.ttl = ttl
+        self._local = threading.local()
+        self._locks = [threading.Lock() for _ in range(self.shards)]
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock_file = os.open(path + '.lock', os.O_RDWR | os.O_CREAT,
+                                  0o600)
+        db = self._db()
+        db.execute('PRAGMA journal_mode = WAL')
+        db.execute('CREATE TABLE IF NOT EXISTS games ('
+                   'id TEXT PRIMARY KEY, watch_id TEXT NOT NULL, '
+                   'state BLOB NOT NULL, last_used REAL NOT NULL)')
+        db.execute('CREATE INDEX IF NOT EXISTS games_last_used '
+                   'ON games (last_used)')
+        db.execute('CREATE UNIQUE INDEX IF NOT EXISTS games_watch_id '
+                   'ON games (watch_id)')
+
+    def _db(self):
+        '''This thread's connection, opened after any fork.'''
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.db = sqlite3.connect(self.path, timeout=30,
+                                       isolation_level=None)
+            local.db.execute('PRAGMA synchronous = NORMAL')
+            local.pid = os.getpid()
+        return local.db
+
+    def __len__(self):
+        return self._db().execute('SELECT COUNT(*) FROM games').fetchone()[0]
+
+    def new(self):
+        game = GameSession(secrets.token_urlsafe(16))
+        now = time.time()
+        db = self._db()
+        db.execute('DELETE FROM games WHERE last_used < ?',
+                   (now - self.ttl,))
+        db.execute('DELETE FROM games WHERE id IN (SELECT id FROM games '
+                   'ORDER BY last_used LIMIT MAX(0, '
+                   '(SELECT COUNT(*) FROM games) - ?))',
+                   (self.max_games - 1,))
+        db.execute('INSERT INTO games VALUES (?, ?, ?, ?)',
+                   (game.id, game.watch_id, self._dumps(game), now))
+        return game
+
+    def find(self, watch_id):
+        row = self._db().execute('SELECT id FROM games WHERE watch_id = ?',
+                                 (watch_id,)).fetchone()
+        return row and row[0]
+
+    def peek(self, game_id):
+        if game_id is None:
+            return None
+        row = self._db().execute(
+            'SELECT state FROM games WHERE id = ? AND last_used >= ?',
+            (game_id, time.time() - self.ttl)).fetchone()
+        if row is None:
+            return None
+        return GameSession(game_id, *pickle.loads(row[0]))
+
+    @contextlib.contextmanager
+    def checkout(self, game_id):
+        if game_id is None:
+            yield None
+            return
+        shard = zlib.crc32(game_id.encode()) % self.shards
+        with self._locks[shard]:
+            fcntl.lockf(self._lock_file, fcntl.LOCK_EX, 1, shard)
+            try:
+                row = self._db().execute(
+                    'SELECT state FROM games WHERE id = ? AND last_used >= ?',
+                    (game_id, time.time() - self.ttl)).fetchone()
+                if row is None:
+                    yield None
+                    return
+                game = GameSession(game_id, *pickle.loads(row[0]))
+                yield game
+                # An evicted or removed game stays gone
+                self._db().execute(
+                    'UPDATE games SET state = ?, last_used = ? WHERE id = ?',
+                    (self._dumps(game), time.time(), game_id))
+            finally:
+                fcntl.lockf(self._lock_file, fcntl.LOCK_UN, 1, shard)
+
+    def remove(self, game_id):
+        self._db().execute('DELETE FROM games WHERE id = ?', (game_id,))
+
+    @staticmethod
+    def _dumps(game):
+        return pickle.dumps((game.board, game.ui),
+                            protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class LRUCache:
+    '''
+    Thread-safe mapping that keeps at most `size` entries,
+    dropping the least recently used one when full.
+    '''
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError('size must be at least 1')
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        '''Remove and return the entry for `key`, or None.'''
+        with self._lock:
+            return self._entries.pop(key, None)
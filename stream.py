@@ -0,0 +1,188 @@
+'''
+Server-Sent Events channel that pushes board updates to browsers.
+
+Flask serves pages and moves; this asyncio server runs in a
+background thread beside it and holds the long-lived event
+streams, so an open browser tab costs a coroutine instead of
+a Flask worker thread.
+
+    GET /events/<watch_id>    text/event-stream of JSON updates
+
+Streams are keyed by a game's watch id (see store.watch_id()), so
+the players' tabs and any number of spectators share one stream
+per game. An event is serialised once and the same bytes are
+written to every connection, and an idle connection is only a
+coroutine waiting for the browser to hang up, so one process can
+hold tens of thousands of them.
+
+With several server processes (see serve.py), one process runs
+the channel and the others send it their events with an
+EventRelay.
+'''
+import asyncio
+import json
+import resource
+import socket
+import threading
+
+
+class EventChannel:
+    '''
+    Broadcasts events to every browser subscribed to a game.
+
+    METHODS
+
+    start(host, port, relay_port=None)
+        Start the event server in a background thread. With a
+        `relay_port`, also broadcast the events EventRelays send
+        to that UDP port on localhost.
+
+    publish(watch_id, event)
+        Send `event` (any JSON-serialisable value) to every
+        subscriber of `watch_id`. Safe to call from any thread,
+        and does nothing if the server is not running.
+    '''
+    keepalive = 15  # seconds between comments on an idle stream
+    # A browser that has this many bytes of events waiting to be
+    # sent is too slow to keep up, and is disconnected
+    max_backlog = 256 * 1024
+
+    def __init__(self):
+        self._subscribers = {}
+        self._loop = None
+
+    def start(self, host='127.0.0.1', port=5001, relay_port=None):
+        # Every stream holds a file descriptor
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        if soft < hard:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        ready = threading.Event()
+
+        def serve():
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(asyncio.start_server(
+                self._handle, host, port, backlog=4096))
+            if relay_port is not None:
+                loop.run_until_complete(loop.create_datagram_endpoint(
+                    lambda: _RelayProtocol(self),
+                    local_addr=('127.0.0.1', relay_port)))
+            loop.create_task(self._keep_alive())
+            self._loop = loop
+            ready.set()
+            loop.run_forever()
+
+        threading.Thread(target=serve, name='event-channel',
+                         daemon=True).start()
+        ready.wait()
+
+    def publish(self, watch_id, event):
+        if self._loop is None:
+            return
+        # Serialise once, however many browsers are listening
+        message = f'data: {json.dumps(event)}\n\n'.encode()
+        self._loop.call_soon_threadsafe(self._broadcast, watch_id, message)
+
+    def subscribers(self, watch_id):
+        return len(self._subscribers.get(watch_id, ()))
+
+    def connections(self):
+        '''Number of open event streams, over all games.'''
+        return sum(map(len, list(self._subscribers.values())))
+
+    def _broadcast(self, watch_id, message):
+        for writer in list(self._subscribers.get(watch_id, ())):
+            self._send(writer, message)
+
+    def _send(self, writer, message):
+        if writer.transport.get_write_buffer_size() > self.max_backlog:
+            writer.close()
+        else:
+            writer.write(message)
+
+    async def _keep_alive(self):
+        '''Write a comment to every stream now and then.'''
+        while True:
+            await asyncio.sleep(self.keepalive)
+            for writers in list(self._subscribers.values()):
+                for writer in list(writers):
+                    self._send(writer, b': keepalive\n\n')
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await reader.readline()
+            # Skip the request headers
+            while (await reader.readline()).strip():
+                pass
+            parts = request_line.decode('latin-1').split()
+            if len(parts) < 2 or parts[0] != 'GET' \
+                    or not parts[1].startswith('/events/'):
+                writer.write(b'HTTP/1.1 404 Not Found\r\n'
+                             b'Content-Length: 0\r\n\r\n')
+                await writer.drain()
+                return
+            watch_id = parts[1][len('/events/'):]
+            writer.write(b'HTTP/1.1 200 OK\r\n'
+                         b'Content-Type: text/event-stream\r\n'
+                         b'Cache-Control: no-cache\r\n'
+                         b'Access-Control-Allow-Origin: *\r\n'
+                         b'Connection: keep-alive\r\n\r\n')
+            await writer.drain()
+            await self._stream(watch_id, reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _stream(self, watch_id, reader, writer):
+        subscribers = self._subscribers.setdefault(watch_id, set())
+        subscribers.add(writer)
+        try:
+            # Events are written by _broadcast(); wait for the
+            # browser to hang up (or for _send() to drop it)
+            while await reader.read(1024):
+                pass
+        finally:
+            subscribers.discard(writer)
+            if not subscribers \
+                    and self._subscribers.get(watch_id) is subscribers:
+                del self._subscribers[watch_id]
+
+
+class _RelayProtocol(asyncio.DatagramProtocol):
+    def __init__(self, channel):
+        self.channel = channel
+
+    def datagram_received(self, data, addr):
+        watch_id, _, event = data.partition(b'\n')
+        self.channel._broadcast(watch_id.decode('ascii', 'replace'),
+                                b'data: ' + event + b'\n\n')
+
+
+class EventRelay:
+    '''
+    Publishes events to the EventChannel of another process on
+    this host, started with relay_port=`port`. Each event is one
+    UDP datagram, so publishing never waits for that process; an
+    event sent while it is down is lost, like one sent to a game
+    nobody is watching.
+
+    METHODS
+
+    publish(watch_id, event)
+        As EventChannel.publish().
+    '''
+    def __init__(self, port):
+        self.address = ('127.0.0.1', port)
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def publish(self, watch_id, event):
+        message = f'{watch_id}\n{json.dumps(event)}'.encode()
+        try:
+            self._socket.sendto(message, self.address)
+        except OSError:
+            pass
+
+    def connections(self):
+        '''The streams are held by the channel's process: 0 here.'''
+        return 0
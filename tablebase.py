@@ -0,0 +1,239 @@
+'''
+Generates the endgame tablebases read by chess.Tablebase, by
+retrograde analysis: every position of an ending is set up on a
+Board and its legal moves listed (in a pool of worker processes),
+then results are worked backwards from the checkmates, one ply
+of distance at a time.
+
+KPK needs KQK and KRK for its promotions, so they are built
+first when asked for together.
+
+Run from the repository root:
+    python tablebase.py
+    python tablebase.py KRK --output instance/tablebases
+'''
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from array import array
+
+from chess import (Board, King, Pawn, PROMOTIONS, TABLEBASE_PIECES,
+                   TABLEBASE_SIZE, FIRST_ROW, LAST_ROW, Tablebase,
+                   tablebase_index)
+
+
+# Successor codes: internal positions are their index. A move that
+# leaves the ending sets EXTERNAL and the ending it goes to, or
+# DRAWN for a drawn one (a capture, or a bishop or knight promotion).
+EXTERNAL = 1 << 31
+DRAWN = 0
+ENDINGS = (None,) + tuple(TABLEBASE_PIECES)
+ILLEGAL = 0xFFFF
+
+
+def unpack_index(index):
+    return index >> 18, index >> 12 & 63, index >> 6 & 63, index & 63
+
+
+def successors(job):
+    '''
+    List the moves of every position in part of an ending, in a
+    worker process.
+
+    Returns:
+    (number of legal moves per position, or ILLEGAL,
+     bytes: whether the player to move is in check,
+     successor codes of all the positions, in order)
+    '''
+    name, start, stop = job
+    cls = TABLEBASE_PIECES[name]
+    counts = array('H')
+    checks = bytearray()
+    codes = array('I')
+    for index in range(start, stop):
+        turn, king, other_king, sq = unpack_index(index)
+        if len({king, other_king, sq}) < 3 \
+                or cls is Pawn and (1 << sq) & (FIRST_ROW | LAST_ROW):
+            counts.append(ILLEGAL)
+            checks.append(0)
+            continue
+        board = Board()
+        board._put(king, King('white'))
+        board._put(other_king, King('black'))
+        board._put(sq, cls('white'))
+        board.turn = 'black' if turn else 'white'
+        # The player who just moved cannot be left in check
+        waiting = other_king if turn == 0 else king
+        if board._attacked(waiting, turn):
+            counts.append(ILLEGAL)
+            checks.append(0)
+            continue
+        moving = king if turn == 0 else other_king
+        checks.append(board._attacked(moving, 1 - turn))
+        moves = board._legal_moves()
+        counts.append(len(moves))
+        for move in moves:
+            move_start, end, flag = move & 63, move >> 6 & 63, move >> 12
+            if turn == 1:
+                if end == sq:
+                    codes.append(EXTERNAL | DRAWN)
+                else:
+                    codes.append(tablebase_index(0, king, end, sq))
+            elif move_start == king:
+                codes.append(tablebase_index(1, end, other_king, sq))
+            elif flag in PROMOTIONS:
+                promoted = PROMOTIONS[flag]
+                ending = 'K' + promoted.symbol.upper() + 'K'
+                if ending in TABLEBASE_PIECES:
+                    codes.append(EXTERNAL | ENDINGS.index(ending) << 20
+                                 | tablebase_index(1, king, other_king, end))
+                else:
+                    codes.append(EXTERNAL | DRAWN)
+            else:
+                codes.append(tablebase_index(1, king, other_king, end))
+    return counts, bytes(checks), codes
+
+
+def generate(name, tables, pool, chunk=4096):
+    '''
+    Work out every position of ending `name`.
+
+    `tables` maps ending names to the bytes of endings already
+    generated, for moves that leave this ending.
+
+    Returns:
+    bytes, one per tablebase_index() as described in chess.Tablebase
+    '''
+    size = TABLEBASE_SIZE
+    jobs = [(name, start, min(start + chunk, size))
+            for start in range(0, size, chunk)]
+    counts = array('H')
+    checks = bytearray()
+    codes = array('I')
+    for part in pool.imap(successors, jobs):
+        counts.extend(part[0])
+        checks.extend(part[1])
+        codes.extend(part[2])
+
+    # Predecessors of each position, as offsets into `parents`
+    first = array('I', [0]) * (size + 1)
+    for code in codes:
+        if not code & EXTERNAL:
+            first[code + 1] += 1
+    for index in range(size):
+        first[index + 1] += first[index]
+    parents = array('I', [0]) * first[size]
+    filled = array('I', first)
+    position = 0
+    for index, count in enumerate(counts):
+        if count == ILLEGAL:
+            continue
+        for code in codes[position:position + count]:
+            if not code & EXTERNAL:
+                parents[filled[code]] = index
+                filled[code] += 1
+        position += count
+
+    # Moves not yet known to lose, and positions that cannot lose
+    # because a move leaves the ending in a draw
+    remaining = array('H', counts)
+    can_draw = bytearray(size)
+    latest = array('H', [0]) * size  # longest known losing move
+    buckets = {}
+    position = 0
+    for index, count in enumerate(counts):
+        if count == ILLEGAL:
+            continue
+        if count == 0:
+            if checks[index]:
+                buckets.setdefault(0, []).append(index)
+            continue
+        for code in codes[position:position + count]:
+            if not code & EXTERNAL:
+                continue
+            ending = ENDINGS[code >> 20 & 0x7FF]
+            value = tables[ending][code & 0xFFFFF] if ending else 0
+            if value == 0:
+                can_draw[index] = 1
+            elif (value - 1) % 2 == 0:
+                # The opponent is lost in value - 1 plies
+                buckets.setdefault(value, []).append(index)
+            else:
+                remaining[index] -= 1
+                latest[index] = max(latest[index], value - 1)
+        if remaining[index] == 0 and not can_draw[index]:
+            buckets.setdefault(latest[index] + 1, []).append(index)
+        position += count
+
+    result = bytearray(size)
+    done = bytearray(size)
+    plies = 0
+    while buckets:
+        for index in buckets.pop(plies, ()):
+            if done[index]:
+                continue
+            done[index] = 1
+            result[index] = plies + 1
+            for parent in parents[first[index]:first[index + 1]]:
+                if done[parent]:
+                    continue
+                if plies % 2 == 0:
+                    # Moving here wins for the parent
+                    buckets.setdefault(plies + 1, []).append(parent)
+                else:
+                    remaining[parent] -= 1
+                    if remaining[parent] == 0 and not can_draw[parent]:
+                        buckets.setdefault(
+                            max(plies, latest[parent]) + 1, []).append(parent)
+        plies += 1
+    return bytes(result)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('names', nargs='*', metavar='ENDING',
+                        help='ending to generate: '
+                        f'{", ".join(TABLEBASE_PIECES)} (default: all)')
+    parser.add_argument('--output', default=os.path.join(
+        'instance', 'tablebases'), help='directory for the .tb files')
+    parser.add_argument('--workers', type=int,
+                        help='worker processes (default: one per CPU)')
+    args = parser.parse_args(argv)
+    names = args.names or list(TABLEBASE_PIECES)
+    for name in names:
+        if name not in TABLEBASE_PIECES:
+            parser.error(f'no tablebase for {name}')
+    os.makedirs(args.output, exist_ok=True)
+
+    tables = {}
+    for name, cls in TABLEBASE_PIECES.items():
+        path = os.path.join(args.output, name + '.tb')
+        if name not in names and os.path.exists(path):
+            with open(path, 'rb') as f:
+                tables[name] = f.read()
+
+    with multiprocessing.Pool(args.workers) as pool:
+        for name in TABLEBASE_PIECES:
+            if name not in names:
+                continue
+            if name == 'KPK' and not ('KQK' in tables and 'KRK' in tables):
+                print('KPK needs the KQK and KRK tablebases first')
+                return 1
+            start = time.perf_counter()
+            tables[name] = generate(name, tables, pool)
+            path = os.path.join(args.output, name + '.tb')
+            with open(path, 'wb') as f:
+                f.write(tables[name])
+            longest = max(tables[name]) - 1
+            print(f'{name}: wrote {path} in '
+                  f'{time.perf_counter() - start:.1f}s, '
+                  f'longest mate {longest} plies')
+    # Check the files can be read back
+    Tablebase(args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+import shutil
+import tempfile
+import unittest
+
+import main
+from chess import Board
+from journal import game_settings, replay
+
+
+class AppTestCase(unittest.TestCase):
+    '''An app of its own, journaling to a temporary directory.'''
+
+    def setUp(self):
+        self.journal_dir = tempfile.mkdtemp(prefix='chess-journal-')
+        self.app = main.create_app(JOURNAL_DIR=self.journal_dir,
+                                   PONDER_MOVES=0)
+        self.client = self.app.test_client()
+
+    def tearDown(self):
+        self.app.extensions['chess'].close()
+        shutil.rmtree(self.journal_dir, ignore_errors=True)
+
+    def start(self, fen=None):
+        if fen is None:
+            self.client.get('/newgame')
+        else:
+            self.client.get('/position', query_string={'fen': fen})
+        return self.client.get_cookie('game_id').value
+
+    def post(self, route, **data):
+        response = self.client.post(route, json=data)
+        self.assertEqual(response.status_code, 200)
+        return response.get_json()
+
+
+class PromotionTest(AppTestCase):
+
+    def test_promote_without_waiting_pawn(self):
+        self.start()
+        update = self.post('/api/promote', promote='Queen')
+        self.assertEqual(update['errmsg'], 'There is no pawn to promote.')
+        self.assertEqual(update['turn'], 'white')
+        self.assertFalse(update['promote'])
+
+    def test_undo_waiting_promotion(self):
+        fen = '4k3/P7/8/8/8/8/8/4K3 w - - 0 1'
+        game_id = self.start(fen)
+        update = self.post('/api/move', move='06 07')
+        self.assertTrue(update['promote'])
+        update = self.post('/api/undo')
+        self.assertIsNone(update['errmsg'])
+        self.assertEqual(update['turn'], 'white')
+        self.assertTrue(update['empty'])
+
+        journal = self.app.extensions['chess'].journal
+        journal.flush()
+        records = dict(journal.load())[game_id]
+        board = Board.from_fen(game_settings(records)[2])
+        replay(board, records)
+        self.assertEqual(board.to_fen(), fen)
+
+        # And the pawn can still promote
+        self.post('/api/move', move='06 07')
+        update = self.post('/api/promote', promote='Queen')
+        self.assertIsNone(update['errmsg'])
+        self.assertEqual(update['turn'], 'black')
+
+
+class UndoTest(AppTestCase):
+
+    def test_engine_moved_first(self):
+        self.client.get('/position', query_string={
+            'fen': '4k3/p7/8/8/8/8/P7/4K3 b - - 0 1',
+            'vs': 'engine', 'ms': 10})
+        game_id = self.client.get_cookie('game_id').value
+        game = self.app.extensions['chess'].games.get(game_id).board
+        self.assertEqual(len(game.movehistory), 1)
+        update = self.post('/api/undo')
+        self.assertEqual(update['errmsg'],
+                         'There is no move of yours to undo.')
+        self.assertEqual(update['turn'], 'white')
+        self.assertEqual(len(game.movehistory), 1)
+
+        # Once the player has moved, their move and the reply go
+        self.post('/api/move', move='01 02')
+        self.assertEqual(len(game.movehistory), 3)
+        update = self.post('/api/undo')
+        self.assertIsNone(update['errmsg'])
+        self.assertEqual(update['turn'], 'white')
+        self.assertEqual(len(game.movehistory), 1)
+
+
+class MoveInputTest(AppTestCase):
+
+    def test_malformed_json(self):
+        self.start()
+        for body in ({'move': 123}, {'move': None}, {}, [1], 'e2e4'):
+            with self.subTest(body=body):
+                response = self.client.post('/api/move', json=body)
+                self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/promote', json=['Queen'])
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post('/api/moves', json=[1])
+        self.assertEqual(response.status_code, 400)
+
+    def test_malformed_move(self):
+        self.start()
+        for move in ('4x 43', '41 4x', '4\u00b2 43', '41 43 '):
+            with self.subTest(move=move):
+                update = self.post('/api/move', move=move)
+                self.assertIsNotNone(update['errmsg'])
+                self.assertEqual(update['turn'], 'white')
+        response = self.client.post('/play', data={'move': '1a 23'})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Invalid move', response.data)
+
+
+class RecoveryTest(AppTestCase):
+
+    def test_recover_position_game(self):
+        game_id = self.start('4k3/P7/8/8/8/8/8/4K3 w - - 0 1')
+        self.post('/api/move', move='40 41')
+        fen = self.app.extensions['chess'].games.get(game_id).board.to_fen()
+        self.app.extensions['chess'].close()
+
+        # A restart replays the journal, from the SETUP record on
+        self.app = main.create_app(JOURNAL_DIR=self.journal_dir,
+                                   PONDER_MOVES=0)
+        session = self.app.extensions['chess'].games.get(game_id)
+        self.assertEqual(session.board.to_fen(), fen)
+        self.client = self.app.test_client()
+        self.client.set_cookie('game_id', game_id)
+        update = self.post('/api/move', move='47 57')
+        self.assertIsNone(update['errmsg'])
+        self.assertEqual(update['turn'], 'white')
+
+
+class StaticTest(AppTestCase):
+
+    def test_only_current_version_is_immutable(self):
+        with self.app.test_request_context():
+            url = main.static_url('chess.js')
+        response = self.client.get(url)
+        self.assertTrue(response.cache_control.immutable)
+        for url in ('/static/chess.js?v=0123456789ab', '/static/chess.js'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse(response.cache_control.immutable)
+            self.assertTrue(response.cache_control.no_cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
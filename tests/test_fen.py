@@ -0,0 +1,71 @@
+import unittest
+
+from chess import Board, EN_PASSANT
+
+
+class FromFenTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        for fen in ('rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1',
+                    'rnbqkbnr/ppp1pppp/8/8/3pP3/8/PPPP1PPP/RNBQKBNR b KQkq e3 0 3',
+                    'rnbqkbnr/pppp1ppp/8/3Pp3/8/8/PPP1PPPP/RNBQKBNR w KQkq e6 0 3',
+                    '8/8/8/8/8/8/8/K6k w - - 12 40'):
+            self.assertEqual(Board.from_fen(fen).to_fen(), fen)
+
+    def test_counters_optional(self):
+        board = Board.from_fen('7k/8/8/8/8/8/8/K7 b - -')
+        self.assertEqual(board.turn, 'black')
+        self.assertEqual((board.halfmove_clock, board.fullmove_number),
+                         (0, 1))
+
+    def test_en_passant_capture(self):
+        board = Board.from_fen('4k3/8/8/3Pp3/8/8/8/4K3 w - e6 0 1')
+        self.assertIn(35 | 44 << 6 | EN_PASSANT << 12, board._legal_moves())
+
+    def test_rejects_malformed(self):
+        for fen in ('', '8/8/8/8/8/8/8/K6k w -',
+                    '8/8/8/8/8/8/K6k w - - 0 1',
+                    '8/8/8/8/8/8/8/K6x w - - 0 1',
+                    '8/8/8/8/8/8/8/K7 w - - 0 1',
+                    'P6k/8/8/8/8/8/8/K7 w - - 0 1',
+                    '7k/8/8/8/8/8/8/K7 x - - 0 1',
+                    '7k/8/8/8/8/8/8/K7 w X - 0 1',
+                    '7k/8/8/8/8/8/8/K7 w - - a 1'):
+            with self.subTest(fen=fen), self.assertRaises(ValueError):
+                Board.from_fen(fen)
+
+    def test_rejects_en_passant_for_wrong_side(self):
+        # d2xe3 would take white's own knight on e2
+        with self.assertRaises(ValueError):
+            Board.from_fen('k7/8/8/8/8/8/3PN3/4K3 w - e3 0 1')
+        with self.assertRaises(ValueError):
+            Board.from_fen('4k3/8/8/3Pp3/8/8/8/4K3 b - e6 0 1')
+
+    def test_rejects_en_passant_without_pawn(self):
+        for fen in ('4k3/8/8/3P4/8/8/8/4K3 w - e6 0 1',
+                    '4k3/8/8/3PN3/8/8/8/4K3 w - e6 0 1',
+                    '4k3/4p3/8/3Pp3/8/8/8/4K3 w - e6 0 1',
+                    '4k3/8/4n3/3Pp3/8/8/8/4K3 w - e6 0 1'):
+            with self.subTest(fen=fen), self.assertRaises(ValueError):
+                Board.from_fen(fen)
+
+    def test_rejects_side_not_to_move_in_check(self):
+        with self.assertRaises(ValueError):
+            Board.from_fen('4k3/8/8/8/8/8/8/4K2r b - - 0 1')
+        # The side to move may be in check
+        Board.from_fen('4k3/8/8/8/8/8/8/4K2r w - - 0 1')
+
+    def test_rejects_castling_without_king_and_rook(self):
+        for fen in ('4k3/8/8/8/8/8/8/4K3 w K - 0 1',
+                    '4k3/8/8/8/8/8/8/R3K3 w K - 0 1',
+                    '4k3/8/8/8/8/8/8/3K3R w K - 0 1',
+                    'r2k4/8/8/8/8/8/8/4K3 w q - 0 1',
+                    'r3k3/8/8/8/8/8/8/4K3 w k - 0 1'):
+            with self.subTest(fen=fen), self.assertRaises(ValueError):
+                Board.from_fen(fen)
+        board = Board.from_fen('r3k2r/8/8/8/8/8/8/R3K2R w KQkq - 0 1')
+        self.assertEqual(board.to_fen().split()[2], 'KQkq')
+
+
+if __name__ == '__main__':
+    unittest.main()
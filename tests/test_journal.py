@@ -0,0 +1,107 @@
+import errno
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from chess import Board
+from journal import (GameJournal, MOVE, RECORD, SETUP, START, game_settings,
+                     read_records, replay)
+
+
+def moves(board, names):
+    '''Play moves like '41 43' on `board`, returning their codes.'''
+    codes = []
+    for name in names:
+        valid, move = board.prompt(name)
+        assert valid, name
+        board.update(move)
+        board.next_turn()
+        codes.append(board.movehistory[-1])
+    return codes
+
+
+class JournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(prefix='chess-journal-')
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.journal = GameJournal(self.directory, interval=0.01)
+
+    def read(self, game_id):
+        with open(self.journal.path(game_id), 'rb') as f:
+            return f.read()
+
+    def test_torn_final_record(self):
+        board = Board()
+        board.start()
+        self.journal.new('game')
+        for code in moves(board, ['41 43', '46 44', '60 52']):
+            self.journal.move('game', code)
+        self.journal.flush()
+        data = self.read('game')
+        for cut in range(1, RECORD.size):
+            records = read_records(data[:-cut])
+            self.assertEqual(len(records), 3)
+            replayed = Board()
+            replayed.start()
+            replay(replayed, records)
+            self.assertEqual(replayed.turn, 'white')
+            self.assertEqual(len(replayed.movehistory), 2)
+
+    def test_torn_setup_record(self):
+        fen = '4k3/8/8/8/8/8/8/4K2R w K - 0 1'
+        self.journal.new('game', fen=fen)
+        self.journal.flush()
+        data = self.read('game')
+        records = read_records(data)
+        self.assertEqual(records[1], (SETUP, 0, fen))
+        self.assertEqual(game_settings(records), (None, None, fen))
+        self.assertEqual(read_records(data[:-1]), records[:1])
+
+    def test_failed_write_is_kept(self):
+        self.journal.new('game')
+        self.journal.flush()
+        self.journal.move('game', 1)
+        self.journal.move('game', 2)
+        real_write = os.write
+
+        def half_then_full_disk(fd, data):
+            # Write part of the batch, then run out of space
+            if len(data) > 2:
+                return real_write(fd, bytes(data[:2]))
+            raise OSError(errno.ENOSPC, 'No space left on device')
+        with mock.patch('journal.os.write', side_effect=half_then_full_disk):
+            with self.assertRaises(OSError):
+                self.journal.flush()
+        self.assertEqual(len(self.read('game')), RECORD.size)
+        self.journal.move('game', 3)
+        self.journal.flush()
+        self.assertEqual([record[2] for record in
+                          read_records(self.read('game'))[1:]], [1, 2, 3])
+
+    def test_writer_survives_errors(self):
+        real_write = os.write
+        failures = [OSError(errno.ENOSPC, 'No space left on device')]
+
+        def flaky_write(fd, data):
+            if failures:
+                raise failures.pop()
+            return real_write(fd, data)
+        with mock.patch('journal.os.write', side_effect=flaky_write), \
+                self.assertLogs('journal') as logs:
+            self.journal.start()
+            self.journal.new('game', 'black', 500)
+            deadline = time.monotonic() + 5
+            while not os.path.exists(self.journal.path('game')) \
+                    or not self.read('game'):
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.01)
+        self.assertEqual(read_records(self.read('game')), [(START, 2, 500)])
+        self.assertIn('Cannot write the game journal', logs.output[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from store import GameStore, SQLiteGameStore
+
+
+class PeekTest(unittest.TestCase):
+
+    def check_peek(self, games):
+        game_id = games.new().id
+        with games.checkout(game_id) as session:
+            session.board.start()
+            session.ui.info = 'started'
+        peeked = games.peek(game_id)
+        self.assertEqual(peeked.ui.info, 'started')
+        self.assertEqual(peeked.board.to_fen(), session.board.to_fen())
+        # Changes to the copy are not saved
+        peeked.ui.info = 'changed'
+        with games.checkout(game_id) as session:
+            self.assertEqual(session.ui.info, 'started')
+        self.assertIsNone(games.peek('no-such-game'))
+        self.assertIsNone(games.peek(None))
+        return game_id
+
+    def test_memory(self):
+        games = GameStore()
+        game_id = self.check_peek(games)
+        session = games.get(game_id)
+        last_used = session.last_used
+        snapshot = games.peek(game_id)
+        self.assertEqual(session.last_used, last_used)
+        # Until the game moves on the same copy is shared
+        self.assertIs(games.peek(game_id), snapshot)
+
+        # A busy game gives the copy made before it got busy
+        peeked = threading.Event()
+        with games.checkout(game_id) as session:
+            session.board.update(session.board.prompt('41 43')[1])
+            session.ui.info = 'moving'
+
+            def peek():
+                self.assertIs(games.peek(game_id), snapshot)
+                peeked.set()
+            threading.Thread(target=peek).start()
+            self.assertTrue(peeked.wait(5))
+        peeked = games.peek(game_id)
+        self.assertEqual(peeked.ui.info, 'moving')
+        self.assertEqual(peeked.board.to_fen(), session.board.to_fen())
+
+    def test_sqlite(self):
+        directory = tempfile.mkdtemp(prefix='chess-store-')
+        self.addCleanup(shutil.rmtree, directory)
+        games = SQLiteGameStore(os.path.join(directory, 'games.sqlite3'))
+        game_id = self.check_peek(games)
+        db = games._db()
+
+        def last_used():
+            return db.execute('SELECT last_used FROM games WHERE id = ?',
+                              (game_id,)).fetchone()[0]
+        before = last_used()
+        games.peek(game_id)
+        self.assertEqual(last_used(), before)
+
+
+if __name__ == '__main__':
+    unittest.main()